@@ -0,0 +1,300 @@
+"""名言图片生成器性能基准
+
+对排版与渲染的热点路径计时：text_wrap、calculate_font_size、get_multiline_height、
+create_quote_image 以及端到端的 process_quotes_file。语料由固定随机种子生成，
+使用随仓库附带的开源字体，保证不同机器之间的结果可比。
+
+    python benchmarks/benchmark.py -o results.json
+    python benchmarks/benchmark.py --compare baseline.json --threshold 0.1
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import fnmatch
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import PIL
+from PIL import Image, ImageDraw
+
+import 名言图片生成器 as quote_gen
+
+# 附带的开源字体（Noto Sans CJK SC 按语料字符集裁剪，SIL OFL 1.1）
+BENCH_FONT = os.path.join(BENCH_DIR, "fonts", "NotoSansCJKsc-Regular-subset.otf")
+
+RESULTS_VERSION = 1
+DEFAULT_SEED = 20240601
+
+# 语料字符池 - 修改后需重新裁剪 fonts/ 下的字体
+HANZI = (
+    "的一是不了人我在有他这中大来上国个到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后"
+    "小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长"
+    "知民样现分将外但身些与高意进把法此实回二理美点月明其种声全工己话儿者向情部正名定女问力机给等几很业最"
+    "间新什打便位因重被走电四第门相次东政海口使教西再平真听世气信北少关并内加化由却代军产入先山五太水万市"
+    "眼体别处总才场师书比住员九笑性通目华报立马命张活难神数件安表原车白应路期叫死常提感金何更反合放做系计"
+    "或司利受光王果亲界及今京务制解各任至清物台象记边共风战干接它许八特觉望直服毛林题建南度统色字请交爱让"
+    "认算论百吃义科怎元社术结六功指思非流每青管夫连远资队跟带花快条院变联言权往展该领传近留红治决周保达办"
+    "运武半候七必城父强步完革深区即求品士转量空甚众技轻程告江语英基派满式李息写呢识极令黄德收脸钱党倒未持"
+    "道可非常苦志降任焉忍仁礼信智勇诚善恶爱恨悲欢离合春夏秋冬"
+)
+KANA = (
+    "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+    "がぎぐげござじずぜぞだぢづでどばびぶべぼぱぴぷぺぽっゃゅょー"
+    "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワヲン"
+    "ガギグゲゴザジズゼゾダヂヅデドバビブベボパピプペポッャュョ"
+)
+KANJI = "人生大戦場時間心愛夢道空花月風雪山川海言葉"
+CJK_PUNCT = "，。、！？；：“”（）《》「」『』…"
+LATIN_WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have from "
+    "or one had by word but not what all were we when your can said there use each which she "
+    "do how their if will up other about out many then them these so some her would make like "
+    "him into time has look two more write go see number no way could people my than first "
+    "water been call who oil its now find long down day did get come made may part life journey "
+    "thousand miles begins single step yourself everyone else already taken imagination knowledge "
+    "AVATAR Wave Today, quickly! jumped; office efficient"
+).split()
+LATIN_PUNCT = ",.;:!?'\"-()"
+
+# (语料名, 条数, 每条长度范围)
+CORPORA_SPEC = [
+    ("cjk_short", 200, (6, 20)),
+    ("cjk_long", 40, (200, 400)),
+    ("kana_short", 200, (6, 20)),
+    ("kana_long", 40, (200, 400)),
+    ("latin_short", 200, (4, 12)),
+    ("latin_long", 40, (60, 120)),
+    ("mixed_short", 200, (6, 20)),
+    ("mixed_long", 40, (150, 300)),
+]
+
+def build_corpus(kind, count, length_range, seed):
+    """按固定种子生成一组名言"""
+    rng = random.Random(f"{seed}:{kind}")
+    quotes = []
+    for _ in range(count):
+        length = rng.randint(*length_range)
+        if kind.startswith("cjk"):
+            chars = [rng.choice(HANZI) for _ in range(length)]
+            for pos in range(rng.randint(6, 12), length, rng.randint(6, 12)):
+                chars[pos] = rng.choice(CJK_PUNCT)
+            quotes.append("".join(chars))
+        elif kind.startswith("kana"):
+            pool = KANA * 3 + KANJI
+            chars = [rng.choice(pool) for _ in range(length)]
+            for pos in range(rng.randint(5, 10), length, rng.randint(5, 10)):
+                chars[pos] = rng.choice("、。")
+            quotes.append("".join(chars))
+        elif kind.startswith("latin"):
+            quotes.append(" ".join(rng.choice(LATIN_WORDS) for _ in range(length)))
+        else:
+            parts = []
+            while sum(len(p) for p in parts) < length:
+                if rng.random() < 0.5:
+                    parts.append("".join(rng.choice(HANZI + KANA) for _ in range(rng.randint(2, 8))))
+                else:
+                    parts.append(" ".join(rng.choice(LATIN_WORDS) for _ in range(rng.randint(1, 3))))
+            quotes.append(" ".join(parts))
+    return quotes
+
+def build_corpora(seed=DEFAULT_SEED, scale=1.0):
+    """生成全部语料，scale 用于快速模式下按比例减少条数"""
+    return {kind: build_corpus(kind, max(1, int(count * scale)), length_range, seed)
+            for kind, count, length_range in CORPORA_SPEC}
+
+def corpus_charset():
+    """语料可能用到的全部字符，用于裁剪附带字体"""
+    return set(HANZI + KANA + KANJI + CJK_PUNCT + LATIN_PUNCT + "".join(LATIN_WORDS)
+               + " 0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+def configure(font_path=BENCH_FONT):
+    """把全局配置重置为默认值并使用基准字体"""
+    quote_gen.current_config.clear()
+    quote_gen.current_config.update(quote_gen.DEFAULT_CONFIG)
+    quote_gen.current_config["FONT_PATH"] = font_path
+    quote_gen.font_registry.clear()
+
+def reset_caches():
+    """清空字体、度量与画布缓存，每轮计时都从冷缓存开始"""
+    quote_gen.font_registry.clear()
+    quote_gen._canvas_templates.clear()
+
+# ---------------------------------------------------------------- 基准用例
+
+def bench_text_wrap(quotes):
+    """在固定字号下对整批名言换行"""
+    config = quote_gen.current_config
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    font = quote_gen.font_registry.get_font(config["FONT_PATH"], 48)
+    max_width = config["IMAGE_WIDTH"] - 2 * config["PADDING"]
+    for quote in quotes:
+        quote_gen.text_wrap(draw, quote, font, max_width)
+
+def bench_calculate_font_size(quotes):
+    """对整批名言做字号搜索"""
+    config = quote_gen.current_config
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    for quote in quotes:
+        quote_gen.calculate_font_size(draw, quote, config["FONT_PATH"], config["IMAGE_WIDTH"])
+
+def _prepare_multiline(quotes):
+    """预先换行，get_multiline_height 只测量高度"""
+    config = quote_gen.current_config
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    font = quote_gen.font_registry.get_font(config["FONT_PATH"], 48)
+    max_width = config["IMAGE_WIDTH"] - 2 * config["PADDING"]
+    return draw, font, [quote_gen.text_wrap(draw, quote, font, max_width) for quote in quotes]
+
+def bench_get_multiline_height(prepared):
+    """测量预先换行的文本块高度"""
+    draw, font, wrapped = prepared
+    for text in wrapped:
+        quote_gen.get_multiline_height(draw, text, font)
+
+def bench_create_quote_image(quotes):
+    """在内存中渲染整批名言（不编码、不写盘）"""
+    for quote in quotes:
+        quote_gen.create_quote_image(quote)
+
+def _prepare_input_file(quotes):
+    """把语料写入临时输入文件"""
+    handle, path = tempfile.mkstemp(suffix=".txt", prefix="quote_bench_")
+    with os.fdopen(handle, "w", encoding="utf-8") as f:
+        f.write("\n".join(quotes))
+    return path
+
+def bench_process_quotes_file(input_path):
+    """端到端：读取文件、排版、渲染、编码并写盘"""
+    with tempfile.TemporaryDirectory(prefix="quote_bench_out_") as output_dir:
+        quote_gen.process_quotes_file(input_path, output_dir, workers=1)
+
+# (用例名, 计时函数, 准备函数, 是否跑长语料)
+CASES = [
+    ("text_wrap", bench_text_wrap, None, True),
+    ("calculate_font_size", bench_calculate_font_size, None, True),
+    ("get_multiline_height", bench_get_multiline_height, _prepare_multiline, True),
+    ("create_quote_image", bench_create_quote_image, None, True),
+    ("process_quotes_file", bench_process_quotes_file, _prepare_input_file, False),
+]
+
+# ---------------------------------------------------------------- 运行与比较
+
+def run_case(func, arg, ops, repeat):
+    """运行 repeat 轮，返回每条名言耗时（微秒）的统计"""
+    samples = []
+    for _ in range(repeat):
+        reset_caches()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(arg)
+            elapsed = time.perf_counter() - start
+        samples.append(elapsed / ops * 1e6)
+    return {
+        "ops": ops,
+        "repeat": repeat,
+        "median_us": statistics.median(samples),
+        "min_us": min(samples),
+        "max_us": max(samples),
+    }
+
+def run_benchmarks(repeat=5, scale=1.0, pattern="*", seed=DEFAULT_SEED):
+    """运行全部匹配的用例，返回可序列化为 JSON 的结果"""
+    configure()
+    corpora = build_corpora(seed, scale)
+    results = {}
+
+    for case_name, func, prepare, run_long in CASES:
+        for corpus_name, quotes in corpora.items():
+            name = f"{case_name}/{corpus_name}"
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+            if corpus_name.endswith("_long") and not run_long:
+                continue
+
+            arg = prepare(quotes) if prepare else quotes
+            try:
+                results[name] = run_case(func, arg, len(quotes), repeat)
+            finally:
+                if prepare is _prepare_input_file:
+                    os.remove(arg)
+            print(f"{name:<40} {results[name]['median_us']:>12.1f} us/quote", file=sys.stderr)
+
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "font": os.path.basename(BENCH_FONT),
+            "seed": seed,
+            "scale": scale,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+def compare_results(current, baseline, threshold):
+    """与基线比较中位数，返回 (报告行, 是否存在回归)"""
+    lines = []
+    regressed = False
+    for name, result in sorted(current["results"].items()):
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            lines.append(f"{name:<40} {result['median_us']:>12.1f} us   (基线中无此项)")
+            continue
+        ratio = result["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  << 回归"
+            regressed = True
+        elif ratio < 1 - threshold:
+            flag = "  (提升)"
+        lines.append(f"{name:<40} {base['median_us']:>12.1f} -> {result['median_us']:>12.1f} us"
+                     f"  x{ratio:.2f}{flag}")
+    return lines, regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="名言图片生成器性能基准")
+    parser.add_argument("-o", "--output", help="结果 JSON 的输出路径（默认打印到标准输出）")
+    parser.add_argument("--compare", metavar="BASELINE", help="与保存的基线结果比较")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="中位数变慢超过该比例即视为回归（默认 0.10）")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="每个用例的运行轮数")
+    parser.add_argument("-k", "--filter", default="*", help="只运行匹配的用例，如 'text_wrap/*'")
+    parser.add_argument("--quick", action="store_true", help="语料缩减为 1/10，用于冒烟测试")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="语料随机种子")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.repeat, 0.1 if args.quick else 1.0, args.filter, args.seed)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    else:
+        json.dump(results, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines, regressed = compare_results(results, baseline, args.threshold)
+        print("\n".join(lines), file=sys.stderr)
+        if regressed:
+            print(f"发现性能回归（阈值 {args.threshold:.0%}）", file=sys.stderr)
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
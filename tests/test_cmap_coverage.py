@@ -0,0 +1,118 @@
+"""cmap 解析（read_cmap_coverage / read_font_coverage）的回归测试，使用手工构造的最小 sfnt 数据"""
+import os
+import struct
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import 名言图片生成器 as quote_gen
+
+
+def format4(segments):
+    """构造 cmap 格式 4 子表；segments 为 (起始, 结束, delta, 字形号列表或 None)"""
+    seg_count = len(segments)
+    glyph_ids = []
+    range_offsets = []
+    for i, (start, end, _, glyphs) in enumerate(segments):
+        if glyphs is None:
+            range_offsets.append(0)
+        else:
+            # 偏移从 idRangeOffset[i] 自身的位置算起，指向 glyphIdArray 中本段的起点
+            range_offsets.append(2 * (seg_count - i) + 2 * len(glyph_ids))
+            glyph_ids += glyphs
+    body = struct.pack(f">{seg_count}H", *(end for _, end, _, _ in segments))
+    body += struct.pack(">H", 0)
+    body += struct.pack(f">{seg_count}H", *(start for start, _, _, _ in segments))
+    body += struct.pack(f">{seg_count}H", *(delta & 0xFFFF for _, _, delta, _ in segments))
+    body += struct.pack(f">{seg_count}H", *range_offsets)
+    body += struct.pack(f">{len(glyph_ids)}H", *glyph_ids)
+    header = struct.pack(">7H", 4, 14 + len(body), 0, 2 * seg_count, 0, 0, 0)
+    return header + body
+
+
+def format12(groups):
+    """构造 cmap 格式 12 子表；groups 为 (起始, 结束, 起始字形号)"""
+    body = b"".join(struct.pack(">3L", *group) for group in groups)
+    return struct.pack(">HHLLL", 12, 0, 16 + len(body), 0, len(groups)) + body
+
+
+def cmap_table(subtables):
+    """构造 cmap 表；subtables 为 [((平台, 编码), 子表字节)]"""
+    records = b""
+    data = b""
+    offset = 4 + 8 * len(subtables)
+    for (platform, encoding), subtable in subtables:
+        records += struct.pack(">HHL", platform, encoding, offset + len(data))
+        data += subtable
+    return struct.pack(">HH", 0, len(subtables)) + records + data
+
+
+def sfnt(subtables, base=0):
+    """构造只含 cmap 表的 sfnt 字形集；base 为字形集在文件中的偏移（TTC 中表偏移从文件开头算起）"""
+    cmap = cmap_table(subtables)
+    header = struct.pack(">LHHHH", 0x00010000, 1, 16, 0, 0)
+    record = struct.pack(">4sLLL", b"cmap", 0, base + 12 + 16, len(cmap))
+    return header + record + cmap
+
+
+SEGMENTS = [
+    (0x41, 0x43, 1, None),                      # 按 delta 映射
+    (0x61, 0x63, -0x62, None),                  # 0x62 + delta 为 0，映射到 .notdef
+    (0x4E00, 0x4E03, 0, [5, 0, 7, 8]),          # 经 idRangeOffset 查 glyphIdArray，0x4E01 无字形
+    (0xFFFF, 0xFFFF, 1, None),                  # 规范要求的结尾段
+]
+
+FORMAT4_RANGES = [(0x41, 0x43), (0x61, 0x61), (0x63, 0x63), (0x4E00, 0x4E00), (0x4E02, 0x4E03)]
+
+GROUPS = [
+    (0x30, 0x39, 0),                            # 起始字形号为 0，第一个码位不计入
+    (0x41, 0x5A, 1),
+    (0x5B, 0x60, 27),                           # 与上一组相邻，合并为一个区间
+    (0x1F600, 0x1F64F, 100),
+]
+
+FORMAT12_RANGES = [(0x31, 0x39), (0x41, 0x60), (0x1F600, 0x1F64F)]
+
+
+def test_format4_delta_and_range_offset_segments():
+    data = sfnt([((3, 1), format4(SEGMENTS))])
+    assert quote_gen.read_cmap_coverage(data) == FORMAT4_RANGES
+
+
+def test_format4_final_0xffff_segment_is_not_covered():
+    data = sfnt([((3, 1), format4([(0xFFF0, 0xFFFF, 1, None)]))])
+    assert quote_gen.read_cmap_coverage(data) == [(0xFFF0, 0xFFFE)]
+
+
+def test_format4_range_offset_applies_delta():
+    # 字形号非零但加上 delta 后为 0 时同样视为无字形
+    data = sfnt([((3, 1), format4([(0x100, 0x101, 3, [4, 0xFFFD]), (0xFFFF, 0xFFFF, 1, None)]))])
+    assert quote_gen.read_cmap_coverage(data) == [(0x100, 0x100)]
+
+
+def test_format12_groups():
+    data = sfnt([((3, 10), format12(GROUPS))])
+    assert quote_gen.read_cmap_coverage(data) == FORMAT12_RANGES
+
+
+def test_format12_preferred_over_format4():
+    for order in (1, -1):
+        subtables = [((3, 1), format4(SEGMENTS)), ((3, 10), format12(GROUPS))][::order]
+        assert quote_gen.read_cmap_coverage(sfnt(subtables)) == FORMAT12_RANGES
+
+
+def test_unknown_subtables_and_missing_cmap():
+    assert quote_gen.read_cmap_coverage(sfnt([((1, 0), format4(SEGMENTS))])) is None
+    no_tables = struct.pack(">LHHHH", 0x00010000, 0, 0, 0, 0)
+    assert quote_gen.read_cmap_coverage(no_tables) is None
+
+
+def test_read_font_coverage_collection(tmp_path):
+    first = sfnt([((3, 1), format4(SEGMENTS))], base=20)
+    second = sfnt([((3, 10), format12(GROUPS))], base=20 + len(first))
+    header = struct.pack(">4sLL", b"ttcf", 0x00010000, 2)
+    header += struct.pack(">2L", 20, 20 + len(first))
+    path = tmp_path / "pair.ttc"
+    path.write_bytes(header + first + second)
+    assert quote_gen.read_font_coverage(str(path)) == [FORMAT4_RANGES, FORMAT12_RANGES]
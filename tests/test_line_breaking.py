@@ -0,0 +1,88 @@
+"""换行规则（break_segments / text_wrap）的回归测试"""
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import 名言图片生成器 as quote_gen
+
+FONT_PATH = os.path.join(ROOT, "benchmarks", "fonts", "NotoSansCJKsc-Regular-subset.otf")
+
+
+def bodies(text):
+    return [body for body, _ in quote_gen.break_segments(text)]
+
+
+@pytest.fixture(scope="module")
+def draw():
+    return ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+@pytest.fixture(scope="module")
+def font():
+    return ImageFont.truetype(FONT_PATH, 20)
+
+
+def test_break_between_ideographs():
+    assert bodies("很长很长") == ["很", "长", "很", "长"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("你好，世界。", ["你", "好，", "世", "界。"]),
+    ("好」吧", ["好」", "吧"]),
+    ("ちょっとキャット", ["ちょっ", "と", "キャッ", "ト"]),
+])
+def test_closing_punctuation_and_small_kana_do_not_start_a_line(text, expected):
+    assert bodies(text) == expected
+
+
+def test_opening_punctuation_does_not_end_a_line():
+    assert bodies("他说「你好」吧") == ["他", "说", "「你", "好」", "吧"]
+
+
+def test_dashes_and_ellipses_stay_together():
+    assert bodies("三——四……六") == ["三", "——", "四", "……", "六"]
+
+
+def test_latin_word_inside_cjk_is_not_split():
+    assert bodies("我爱Python编程") == ["我", "爱", "Python", "编", "程"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("we’re here", ["we’re", "here"]),
+    ("don’t stop", ["don’t", "stop"]),
+    ("rock’n’roll", ["rock’n’roll"]),
+    ("“quoted” words", ["“quoted”", "words"]),
+])
+def test_curly_quotes_and_apostrophes_do_not_split_words(text, expected):
+    assert bodies(text) == expected
+
+
+def test_apostrophe_words_wrap_whole(draw, font):
+    text = "for and we’re never going to rock’n’roll, don’t stop"
+    for width in range(60, 400, 20):
+        words = [word for line in quote_gen.text_wrap(draw, text, font, width).split("\n")
+                 for word in line.split()]
+        assert words == text.split()
+
+
+def test_latin_words_keep_trailing_spaces_and_break_after_hyphen():
+    assert quote_gen.break_segments("x-ray test") == [("x-", ""), ("ray", " "), ("test", "")]
+
+
+def test_wrapped_cjk_lines_respect_punctuation_rules(draw, font):
+    lines = quote_gen.text_wrap(draw, "你好你好你好你好。「你好」你好你好", font, 100).split("\n")
+    assert "".join(lines) == "你好你好你好你好。「你好」你好你好"
+    for line in lines:
+        assert not line.startswith(("。", "」"))
+        assert not line.endswith("「")
+
+
+def test_long_unbreakable_run_stays_on_one_line(draw, font):
+    word = "abcdefghijklmnopqrstuvwxyzabcdefghij"
+    assert quote_gen.text_wrap(draw, word, font, 100) == word
+    assert quote_gen.text_wrap(draw, f"你好{word}你好", font, 100).split("\n") == ["你好", word, "你好"]
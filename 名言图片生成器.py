@@ -1,12 +1,24 @@
+import io
 import os
+import mmap
 import re
-import tkinter as tk
-from tkinter import filedialog, messagebox, colorchooser, ttk
-from PIL import Image, ImageDraw, ImageFont
+import sys
+import time
+import codecs
+import hashlib
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps
 import threading
 import json
+import queue
+import shutil
+import tarfile
+import zipfile
 import traceback
-import tempfile
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple, deque
+
+# tkinter 只在启动图形界面时导入，命令行渲染不依赖显示环境
 
 # 默认配置参数 - 移除了强调色
 DEFAULT_CONFIG = {
@@ -18,12 +30,240 @@ DEFAULT_CONFIG = {
     "BASE_FONT_SIZE": 40,                 # 基础字体大小
     "MIN_FONT_SIZE": 32,                  # 最小字体大小
     "MAX_FONT_SIZE": 100,                 # 最大字体大小
-    "FONT_PATH": None                     # 自定义字体路径
+    "FONT_PATH": None,                    # 自定义字体路径
+    "WORKERS": 1,                         # 并行进程数（1 为单进程）
+    "OUTPUT_FORMAT": "png",               # 输出格式: png / jpeg / webp
+    "PNG_COMPRESS_LEVEL": 6,              # PNG 压缩级别 (0-9，越低越快)
+    "PNG_PALETTE_COLORS": 0,              # PNG 调色板颜色数 (0 为真彩色)
+    "JPEG_QUALITY": 90,                   # JPEG 质量 (1-95)
+    "WEBP_QUALITY": 90,                   # WebP 质量 (0-100)
+    "WEBP_LOSSLESS": False,               # WebP 是否无损
+    "WEBP_METHOD": 4,                     # WebP 编码速度/压缩率权衡 (0 最快, 6 最慢)
+    "WRITE_BEHIND": 8,                    # 后台编码写盘的排队图片数 (0 为同步写盘)
+    "ENCODE_THREADS": 1,                  # 后台编码线程数
+    "WRITE_THREADS": 1,                   # 后台写盘线程数
+    "MAX_IN_FLIGHT": 64,                  # 已提交渲染但尚未写完的图片数上限
+    "OUTPUT_SINK": "dir",                 # 输出方式: dir / zip / tar / sprite
+    "SPRITE_COLUMNS": 4,                  # 精灵图每行的图片数
+    "SPRITE_ROWS": 4,                     # 精灵图每列的图片数
+    "VARIANTS": [],                       # 多版本输出，如 ["landscape", "square"]（空为只输出当前尺寸）
+    "FONT_FALLBACK": True,                # 字体缺字时按字符覆盖改用其他系统字体
+    "FONT_DIRS": [],                      # 系统字体目录之外额外扫描的字体目录
+    "BACKGROUND_IMAGE": None,             # 背景图片路径（None 为纯色背景）
+    "BACKGROUND_FIT": "cover",            # 背景图片缩放方式: cover / contain / stretch / tile
+    "BACKGROUND_GRADIENT": None,          # 渐变终点颜色，从背景颜色渐变到该颜色（None 为不渐变）
+    "GRADIENT_DIRECTION": "vertical",     # 渐变方向: vertical / horizontal / diagonal
+    "OVERLAY_COLOR": None,                # 叠加在背景上的半透明颜色，用于压暗或提亮背景图片
+    "OVERLAY_OPACITY": 0.0                # 叠加层不透明度 (0-1)
 }
 
+# 配置中的颜色项，JSON 中的列表统一转为元组
+COLOR_KEYS = ("BACKGROUND_COLOR", "TEXT_COLOR", "BACKGROUND_GRADIENT", "OVERLAY_COLOR")
+
+# 只影响生成速度、不影响输出内容的配置项
+PERFORMANCE_KEYS = ("WORKERS", "WRITE_BEHIND", "ENCODE_THREADS", "WRITE_THREADS", "MAX_IN_FLIGHT")
+
 # 当前配置 - 初始化为默认值
 current_config = DEFAULT_CONFIG.copy()
 
+# 常用发布尺寸，VARIANTS 中的名称对应这里的配置覆盖项
+VARIANT_PRESETS = {
+    "landscape": {"IMAGE_WIDTH": 1200, "IMAGE_HEIGHT": 800},
+    "square": {"IMAGE_WIDTH": 1080, "IMAGE_HEIGHT": 1080},
+    "story": {"IMAGE_WIDTH": 1080, "IMAGE_HEIGHT": 1920},
+    "thumb": {"IMAGE_WIDTH": 400, "IMAGE_HEIGHT": 400, "PADDING": 16,
+              "MIN_FONT_SIZE": 12, "MAX_FONT_SIZE": 40},
+}
+
+# 输出格式 -> (Pillow 格式名, 文件扩展名)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "png"),
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+}
+
+def load_config_file(config_path):
+    """从 JSON 文件加载配置到 current_config，返回加载的内容"""
+    with open(config_path, "r", encoding="utf-8") as f:
+        loaded = json.load(f)
+    
+    # JSON 中的颜色是列表，统一转为元组
+    for key in COLOR_KEYS:
+        if isinstance(loaded.get(key), list):
+            loaded[key] = tuple(loaded[key])
+    
+    if (loaded.get("FONT_PATH", current_config["FONT_PATH"]) != current_config["FONT_PATH"]
+            or loaded.get("FONT_DIRS", current_config["FONT_DIRS"]) != current_config["FONT_DIRS"]):
+        font_registry.clear()
+    current_config.update(loaded)
+    return loaded
+
+def get_output_filename(index, output_format=None):
+    """返回第 index 条名言（从 0 开始）的输出文件名"""
+    if output_format is None:
+        output_format = current_config["OUTPUT_FORMAT"]
+    return f"quote_{index+1:03d}.{OUTPUT_FORMATS[output_format][1]}"
+
+class RenderStats:
+    """渲染性能统计：按阶段累计耗时和计数，可导出为 JSON 报告或逐条回调
+    
+    阶段包括 font_resolve（字体解析）、font_load（加载字体文件）、fit（字号搜索）、
+    wrap（换行）、raster（绘制，其中 background 为解码缩放背景图片）、encode（图片编码）
+    和 write（写盘）。
+    """
+    
+    def __init__(self, callback=None, keep_quotes=True):
+        self.callback = callback
+        self.keep_quotes = keep_quotes
+        self.quotes = []
+        self.stages = {}
+        self.counters = {}
+        self.quote_count = 0
+        self.started = time.perf_counter()
+        self._batch = self._new_record()
+        self._record = self._batch
+        self._quote_started = None
+    
+    @staticmethod
+    def _new_record():
+        return {"stages": {}, "counters": {}}
+    
+    def add_time(self, stage, seconds):
+        """累计当前名言（或批次级）某个阶段的耗时"""
+        stages = self._record["stages"]
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    
+    def count(self, name, n=1):
+        """累计当前名言（或批次级）的计数器"""
+        counters = self._record["counters"]
+        counters[name] = counters.get(name, 0) + n
+    
+    def add_batch_time(self, stage, seconds):
+        """累计不属于某条名言的耗时（例如后台写盘线程）"""
+        stages = self._batch["stages"]
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    
+    def annotate(self, **info):
+        """为当前名言附加排版信息，如字号、行数"""
+        self._record.update(info)
+    
+    def start_quote(self):
+        """开始记录一条名言"""
+        self._record = self._new_record()
+        self._quote_started = time.perf_counter()
+    
+    def finish_quote(self, index=None):
+        """结束当前名言的记录并返回，之后的统计回到批次级"""
+        record = self._record
+        record["index"] = index
+        record["seconds"] = time.perf_counter() - self._quote_started
+        self._record = self._batch
+        return record
+    
+    def add_record(self, record):
+        """把一条名言的记录（可能来自工作进程）汇总到总计中"""
+        self.quote_count += 1
+        self._merge(record, is_quote=True)
+        if self.keep_quotes:
+            self.quotes.append(record)
+        if self.callback is not None:
+            self.callback(record)
+    
+    def _merge(self, record, is_quote):
+        for stage, seconds in record["stages"].items():
+            total = self.stages.setdefault(stage, {"seconds": 0.0, "count": 0, "max": 0.0})
+            total["seconds"] += seconds
+            if is_quote:
+                total["count"] += 1
+                total["max"] = max(total["max"], seconds)
+        for name, n in record["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+    
+    def report(self):
+        """返回可序列化为 JSON 的汇总报告"""
+        stages = {}
+        for stage, total in sorted(self.stages.items()):
+            stages[stage] = {
+                "seconds": total["seconds"],
+                "count": total["count"],
+                "mean_ms": total["seconds"] / total["count"] * 1000 if total["count"] else None,
+                "max_ms": total["max"] * 1000,
+            }
+        for stage, seconds in self._batch["stages"].items():
+            total = stages.setdefault(stage, {"seconds": 0.0, "count": 0, "mean_ms": None,
+                                              "max_ms": 0.0})
+            total["seconds"] += seconds
+            total["batch_seconds"] = seconds
+        
+        counters = dict(self.counters)
+        for name, n in self._batch["counters"].items():
+            counters[name] = counters.get(name, 0) + n
+        
+        report = {
+            "quotes": self.quote_count,
+            "wall_seconds": time.perf_counter() - self.started,
+            "stages": stages,
+            "counters": counters,
+        }
+        if self.keep_quotes:
+            report["per_quote"] = self.quotes
+        return report
+    
+    def save(self, report_path):
+        """把报告写入 JSON 文件"""
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+    
+    def summary(self):
+        """返回各阶段耗时的简短文字汇总"""
+        report = self.report()
+        lines = [f"共 {report['quotes']} 条，耗时 {report['wall_seconds']:.2f} 秒"]
+        for stage, total in report["stages"].items():
+            lines.append(f"  {stage:<20} {total['seconds']:>10.3f} 秒")
+        for name, n in sorted(report["counters"].items()):
+            lines.append(f"  {name:<20} {n:>10d} 次")
+        return lines
+
+class _StageTimer:
+    """把 with 块的耗时计入指定阶段"""
+    __slots__ = ("stats", "stage", "started")
+    
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+    
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.stage, time.perf_counter() - self.started)
+
+class _NullTimer:
+    """未开启统计时使用的空计时器"""
+    __slots__ = ()
+    
+    def __enter__(self):
+        pass
+    
+    def __exit__(self, *exc_info):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+# 当前生效的统计对象，为 None 时所有埋点只做一次判断
+_stats = None
+
+def _timed(stage):
+    """返回计入指定阶段的计时器"""
+    if _stats is None:
+        return _NULL_TIMER
+    return _StageTimer(_stats, stage)
+
+def _count(name, n=1):
+    """累加计数器"""
+    if _stats is not None:
+        _stats.count(name, n)
+
 # 中文字体优先列表
 CHINESE_FONTS = [
     "simhei.ttf", "simsun.ttc", "msyh.ttc", "msyhbd.ttc", 
@@ -38,15 +278,34 @@ ENGLISH_FONTS = [
     "Times New Roman.ttf", "Georgia.ttf"
 ]
 
-def get_system_font(custom_path=None):
-    """获取系统字体，优先使用自定义字体"""
+# 已加载字体对象的缓存上限（按 路径/字号/索引 计）
+FONT_CACHE_SIZE = 32
+
+# 每个字体缓存的字符/单词度量条目上限
+GLYPH_METRICS_CACHE_SIZE = 8192
+
+# 字形遮罩缓存的总字节数上限（0 为不缓存，每行直接调用 draw.text）
+GLYPH_ATLAS_BYTES = 32 * 1024 * 1024
+
+# 估算行宽与可用宽度相差不超过该像素数时，改用整行精确测量，保证换行结果不变
+WRAP_EXACT_MARGIN = 1
+
+def _probe_system_font(custom_path=None):
+    """逐个尝试候选字体，返回第一个可加载的字体路径"""
     if custom_path and os.path.exists(custom_path):
         return custom_path
     
+    # 先在字体索引中按文件名查找，命中时不必逐个加载
+    font_index.load(current_config.get("FONT_DIRS"))
+    for font in CHINESE_FONTS + ENGLISH_FONTS:
+        path = font_index.find(font)
+        if path:
+            return path
+    
     # 尝试查找中文字体
     for font in CHINESE_FONTS:
         try:
-            test_font = ImageFont.truetype(font, current_config["BASE_FONT_SIZE"])
+            font_registry.get_font(font, current_config["BASE_FONT_SIZE"])
             return font
         except:
             continue
@@ -54,15 +313,761 @@ def get_system_font(custom_path=None):
     # 尝试英文字体
     for font in ENGLISH_FONTS:
         try:
-            test_font = ImageFont.truetype(font, current_config["BASE_FONT_SIZE"])
+            font_registry.get_font(font, current_config["BASE_FONT_SIZE"])
             return font
         except:
             continue
     
     return None
 
+def _sfnt_table_tags(font_path, index=0):
+    """读取 TrueType/OpenType（含 .ttc 集合）字体的表目录，返回表标签集合；无法解析时返回 None"""
+    try:
+        with open(font_path, "rb") as f:
+            header = f.read(12)
+            if header[:4] == b"ttcf":
+                f.seek(12 + 4 * index)
+                offset = int.from_bytes(f.read(4), "big")
+                f.seek(offset)
+                header = f.read(12)
+            count = int.from_bytes(header[4:6], "big")
+            directory = f.read(16 * count)
+    except (OSError, TypeError):
+        return None
+    if len(directory) < 16 * count:
+        return None
+    return {directory[i:i + 4] for i in range(0, 16 * count, 16)}
+
+class FontMetrics:
+    """单个字体的度量缓存：片段（字符或单词）的前进宽度、水平边界以及片段间的字距
+    
+    kerned 为 False 时字体不做字距调整，kerning() 直接返回 0，省去逐对测量。
+    """
+    
+    def __init__(self, font, max_entries=GLYPH_METRICS_CACHE_SIZE, kerned=True):
+        self.font = font
+        self.max_entries = max_entries
+        self.kerned = kerned
+        self._segments = {}
+        self._vertical = {}
+        self._kerning = {}
+    
+    def segment(self, text):
+        """返回片段的 (前进宽度, 左边界, 右边界)，以原点为基准"""
+        metrics = self._segments.get(text)
+        if metrics is None:
+            _count("glyph_measure_calls")
+            if len(self._segments) >= self.max_entries:
+                self._segments.clear()
+                self._vertical.clear()
+            left, top, right, bottom = self.font.getbbox(text)
+            metrics = (self.font.getlength(text), left, right)
+            self._segments[text] = metrics
+            self._vertical[text] = (top, bottom)
+        return metrics
+    
+    def line_size(self, text):
+        """由逐字缓存的边界拼出整行的 (宽, 高)，与 textbbox 的结果一致
+        
+        字距使笔位落在小数像素上时 FreeType 会取整，拼接结果可能差一个像素，此时返回 None。
+        """
+        if not text:
+            return None
+        pen = 0
+        prev_char = None
+        left = top = right = bottom = None
+        for char in text:
+            if prev_char is not None:
+                pen += self.kerning(prev_char, char)
+                if pen != int(pen):
+                    return None
+            advance, char_left, char_right = self.segment(char)
+            char_top, char_bottom = self._vertical[char]
+            if left is None:
+                left, top, right, bottom = pen + char_left, char_top, pen + char_right, char_bottom
+            else:
+                left = min(left, pen + char_left)
+                top = min(top, char_top)
+                right = max(right, pen + char_right)
+                bottom = max(bottom, char_bottom)
+            pen += advance
+            prev_char = char
+        return (int(right - left), bottom - top)
+    
+    def kerning(self, prev_char, next_char):
+        """返回两个相邻字符之间的字距调整量"""
+        if not self.kerned:
+            return 0
+        pair = prev_char + next_char
+        kern = self._kerning.get(pair)
+        if kern is None:
+            _count("glyph_measure_calls")
+            if len(self._kerning) >= self.max_entries:
+                self._kerning.clear()
+            kern = (self.font.getlength(pair) - self.segment(prev_char)[0]
+                    - self.segment(next_char)[0])
+            self._kerning[pair] = kern
+        return kern
+
+class FontRegistry:
+    """字体注册表：每个 FONT_PATH 只解析一次，并按 LRU 缓存 FreeTypeFont 对象及其度量"""
+    
+    def __init__(self, max_fonts=FONT_CACHE_SIZE):
+        self.max_fonts = max_fonts
+        self._lock = threading.RLock()
+        self._resolved = {}
+        self._fonts = OrderedDict()
+        self._metrics = OrderedDict()
+        self._kern_tables = {}
+    
+    def resolve(self, custom_path=None):
+        """返回配置对应的字体路径，结果按 custom_path 缓存"""
+        with self._lock:
+            if custom_path not in self._resolved:
+                self._resolved[custom_path] = _probe_system_font(custom_path)
+            return self._resolved[custom_path]
+    
+    def get_font(self, font_path, size, index=0):
+        """获取指定路径、字号和索引的字体对象，超出上限时淘汰最久未用的
+        
+        font_path 也可以是字体索引给出的 (路径, 字形集序号)，用于 .ttc 中的非首个字形集；
+        或者是 font_for_text 给出的 FontStack，此时返回按字符回退的 FallbackFont。
+        """
+        if isinstance(font_path, FontStack):
+            return self._get_stack_font(font_path, size)
+        if isinstance(font_path, tuple):
+            font_path, index = font_path
+        key = (font_path, size, index)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                return font
+            
+            with _timed("font_load"):
+                if font_path:
+                    font = ImageFont.truetype(font_path, size, index=index)
+                else:
+                    font = ImageFont.load_default()
+            _count("font_loads")
+            
+            self._fonts[key] = font
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+            return font
+    
+    def _get_stack_font(self, stack, size):
+        """由 FontStack 组合出按字符回退的字体，各组成字体照常按路径缓存"""
+        key = (stack, size, 0)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                return font
+            
+            fonts = {}
+            for chars, face in stack.fallbacks:
+                fallback = self.get_font(face, size)
+                for char in chars:
+                    fonts[char] = fallback
+            font = FallbackFont(self.get_font(stack.primary, size), fonts)
+            
+            self._fonts[key] = font
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+            return font
+    
+    def _has_kerning(self, font):
+        """判断字体在当前排版引擎下是否可能有字距调整
+        
+        BASIC 引擎只读取 'kern' 表（不读 GPOS），没有该表的字体（多数中文字体）字距恒为 0。
+        """
+        if getattr(font, "layout_engine", None) != ImageFont.Layout.BASIC:
+            return True
+        path = getattr(font, "path", None)
+        if not isinstance(path, str):
+            return True
+        key = (path, getattr(font, "index", 0))
+        if key not in self._kern_tables:
+            tags = _sfnt_table_tags(*key)
+            self._kern_tables[key] = tags is None or b"kern" in tags
+        return self._kern_tables[key]
+    
+    def metrics(self, font):
+        """获取字体对应的度量缓存；不支持逐字测量的字体返回 None"""
+        if not (hasattr(font, "getlength") and hasattr(font, "getbbox")):
+            return None
+        
+        if getattr(font, "path", None):
+            key = (font.path, font.size, getattr(font, "index", 0))
+        else:
+            key = id(font)
+        
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None or metrics.font is not font:
+                metrics = FontMetrics(font, kerned=self._has_kerning(font))
+                self._metrics[key] = metrics
+            self._metrics.move_to_end(key)
+            while len(self._metrics) > self.max_fonts:
+                self._metrics.popitem(last=False)
+            return metrics
+    
+    def clear(self):
+        """清空已解析的路径、已加载的字体及其度量（字体配置变化时调用）"""
+        with self._lock:
+            self._resolved.clear()
+            self._fonts.clear()
+            self._metrics.clear()
+            self._kern_tables.clear()
+        glyph_atlas.clear()
+
+font_registry = FontRegistry()
+
+class GlyphAtlas:
+    """字形遮罩缓存：按 (字体, 字号, 字符, 子像素起点) 缓存 FreeType 栅格化结果，按字节数 LRU 淘汰
+    
+    字形由 draw.text 单独栅格化，与整行绘制时的结果相同；逐个粘贴到画布上时，
+    只要各字形的非空区域互不重叠、前进位置都是整数像素，结果就与 draw.text
+    逐像素一致。FreeType 对重叠像素的合成方式与简单叠加不同，因此有重叠或
+    小数前进宽度的行仍交给 draw.text 绘制。
+    """
+    
+    def __init__(self, max_bytes=GLYPH_ATLAS_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._glyphs = OrderedDict()
+        self._bytes = 0
+    
+    def glyph(self, font, char, start):
+        """返回 (遮罩, x 偏移, y 偏移)，偏移相对于字形原点；空白字符返回 None"""
+        key = (font.path, font.size, getattr(font, "index", 0), char, start)
+        with self._lock:
+            if key in self._glyphs:
+                self._glyphs.move_to_end(key)
+                _count("glyph_atlas_hits")
+                return self._glyphs[key]
+        
+        glyph = self._rasterize(font, char, start)
+        size = glyph[0].width * glyph[0].height if glyph is not None else 1
+        with self._lock:
+            if key not in self._glyphs and size <= self.max_bytes:
+                self._glyphs[key] = glyph
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._glyphs.popitem(last=False)
+                    self._bytes -= evicted[0].width * evicted[0].height if evicted else 1
+        return glyph
+    
+    @staticmethod
+    def _draw(font, char, start, origin, size):
+        """在给定画布上绘制单个字符，返回 ((裁剪后的遮罩, x 偏移, y 偏移), 是否碰到画布边缘)"""
+        canvas = Image.new("L", size, 0)
+        ImageDraw.Draw(canvas).text((origin[0] + start[0], origin[1] + start[1]), char,
+                                    fill=255, font=font)
+        bbox = canvas.getbbox()
+        if bbox is None:
+            return None, False
+        clipped = bbox[0] == 0 or bbox[1] == 0 or bbox[2] == size[0] or bbox[3] == size[1]
+        return (canvas.crop(bbox), bbox[0] - origin[0], bbox[1] - origin[1]), clipped
+    
+    def _rasterize(self, font, char, start):
+        """单独栅格化一个字符；空白字符返回 None"""
+        _count("glyph_rasterize")
+        
+        # 先按字号留出足够边距，省去 getbbox；字形碰到画布边缘时再按精确边界重画
+        margin = font.size // 2 + 2
+        ascent, descent = font.getmetrics()
+        glyph, clipped = self._draw(font, char, start, (margin, margin),
+                                    (2 * font.size + 2 * margin, ascent + descent + 2 * margin))
+        if clipped:
+            left, top, right, bottom = font.getbbox(char)
+            origin = (2 + max(0, -left), 2 + max(0, -top))
+            glyph, _ = self._draw(font, char, start, origin,
+                                  (origin[0] + max(right, 0) + 3, origin[1] + max(bottom, 0) + 3))
+        return glyph
+    
+    def clear(self):
+        with self._lock:
+            self._glyphs.clear()
+            self._bytes = 0
+
+glyph_atlas = GlyphAtlas()
+
+def draw_text_line(draw, position, line, font, fill):
+    """绘制一行文本，尽量使用缓存的字形遮罩；结果与 draw.text 逐像素一致"""
+    x, y = position
+    if isinstance(font, FallbackFont):
+        # 按字体分段，每段用各自的字体绘制，仍可使用字形遮罩缓存
+        for run, run_font, offset_x, offset_y in font.runs(line):
+            draw_text_line(draw, (x + offset_x, y + offset_y), run, run_font, fill)
+        return
+    
+    origin_x, origin_y = int(x), int(y)
+    start = (x - origin_x, y - origin_y)
+    metrics = font_registry.metrics(font)
+    # 复杂排版（raqm）会做连字和重排，不能逐字拼接
+    if (glyph_atlas.max_bytes <= 0 or metrics is None or not getattr(font, "path", None)
+            or getattr(font, "layout_engine", None) != ImageFont.Layout.BASIC
+            or start[0] < 0 or start[1] < 0):
+        draw.text(position, line, fill=fill, font=font)
+        return
+    
+    # 先只用缓存的度量确定每个字符的位置，有小数前进宽度时不必再栅格化
+    pens = []
+    pen = 0
+    prev_char = None
+    for char in line:
+        if prev_char is not None:
+            pen += metrics.kerning(prev_char, char)
+        pens.append(int(pen))
+        pen += metrics.segment(char)[0]
+        prev_char = char
+        if pen != int(pen):
+            draw.text(position, line, fill=fill, font=font)
+            return
+    
+    glyphs = []
+    right = None
+    for char, pen in zip(line, pens):
+        glyph = glyph_atlas.glyph(font, char, start)
+        if glyph is None:
+            continue
+        mask, offset_x, offset_y = glyph
+        if right is not None and pen + offset_x < right:
+            draw.text(position, line, fill=fill, font=font)
+            return
+        right = pen + offset_x + mask.width
+        glyphs.append((mask, pen + offset_x, offset_y))
+    
+    for mask, glyph_x, offset_y in glyphs:
+        draw.bitmap((origin_x + glyph_x, origin_y + offset_y), mask, fill=fill)
+
+# 字体覆盖索引的磁盘缓存位置与格式版本
+if sys.platform == "win32":
+    _CACHE_ROOT = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+elif sys.platform == "darwin":
+    _CACHE_ROOT = os.path.expanduser("~/Library/Caches")
+else:
+    _CACHE_ROOT = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+FONT_INDEX_PATH = os.path.join(_CACHE_ROOT, "quote-image", "font_index.json")
+FONT_INDEX_VERSION = 1
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc", ".otc")
+
+# 缺字回退时按字符缓存的覆盖位图条目上限
+FALLBACK_CACHE_SIZE = 65536
+
+def system_font_dirs():
+    """返回当前平台的系统与用户字体目录"""
+    if sys.platform == "win32":
+        dirs = [os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts")]
+        if os.environ.get("LOCALAPPDATA"):
+            dirs.append(os.path.join(os.environ["LOCALAPPDATA"], "Microsoft", "Windows", "Fonts"))
+    elif sys.platform == "darwin":
+        dirs = ["/System/Library/Fonts", "/Library/Fonts", os.path.expanduser("~/Library/Fonts")]
+    else:
+        dirs = ["/usr/share/fonts", "/usr/local/share/fonts", os.path.expanduser("~/.fonts"),
+                os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+                             "fonts")]
+    return dirs
+
+def _parse_cmap_format4(data, offset):
+    """解析 cmap 格式 4（基本平面分段映射），返回有字形的码位区间"""
+    seg_count = int.from_bytes(data[offset + 6:offset + 8], "big") // 2
+    ends = offset + 14
+    starts = ends + 2 * seg_count + 2
+    deltas = starts + 2 * seg_count
+    range_offsets = deltas + 2 * seg_count
+    ranges = []
+    for i in range(seg_count):
+        end = int.from_bytes(data[ends + 2 * i:ends + 2 * i + 2], "big")
+        start = int.from_bytes(data[starts + 2 * i:starts + 2 * i + 2], "big")
+        delta = int.from_bytes(data[deltas + 2 * i:deltas + 2 * i + 2], "big")
+        range_offset = int.from_bytes(data[range_offsets + 2 * i:range_offsets + 2 * i + 2], "big")
+        end = min(end, 0xFFFE)
+        if start > end:
+            continue
+        if range_offset == 0:
+            # 字形号为 (码位 + delta) mod 65536，只有一个码位可能映射到 .notdef
+            missing = (-delta) & 0xFFFF
+            if start <= missing <= end:
+                ranges += [(start, missing - 1), (missing + 1, end)]
+            else:
+                ranges.append((start, end))
+            continue
+        base = range_offsets + 2 * i + range_offset - 2 * start
+        for code in range(start, end + 1):
+            glyph = int.from_bytes(data[base + 2 * code:base + 2 * code + 2], "big")
+            if glyph and (glyph + delta) & 0xFFFF:
+                ranges.append((code, code))
+    return ranges
+
+def _parse_cmap_format12(data, offset):
+    """解析 cmap 格式 12（分组映射，覆盖全部平面），返回有字形的码位区间"""
+    count = int.from_bytes(data[offset + 12:offset + 16], "big")
+    ranges = []
+    for i in range(count):
+        group = offset + 16 + 12 * i
+        start = int.from_bytes(data[group:group + 4], "big")
+        end = int.from_bytes(data[group + 4:group + 8], "big")
+        if int.from_bytes(data[group + 8:group + 12], "big") == 0:
+            start += 1
+        if start <= end:
+            ranges.append((start, end))
+    return ranges
+
+# cmap 子表的优先顺序：(平台, 编码) -> 可接受的格式
+_CMAP_PREFERENCE = ((3, 10, 12), (0, 6, 12), (0, 4, 12), (3, 1, 4), (0, 3, 4), (0, 2, 4),
+                    (0, 1, 4), (0, 0, 4))
+
+def read_cmap_coverage(data, face_offset=0):
+    """从 sfnt 字形集解析 cmap，返回合并后的码位区间 [(起始, 结束), ...]；没有可用子表时返回 None"""
+    num_tables = int.from_bytes(data[face_offset + 4:face_offset + 6], "big")
+    cmap = None
+    for i in range(num_tables):
+        record = face_offset + 12 + 16 * i
+        if data[record:record + 4] == b"cmap":
+            cmap = int.from_bytes(data[record + 8:record + 12], "big")
+            break
+    if cmap is None:
+        return None
+    
+    subtables = {}
+    for i in range(int.from_bytes(data[cmap + 2:cmap + 4], "big")):
+        record = cmap + 4 + 8 * i
+        platform = int.from_bytes(data[record:record + 2], "big")
+        encoding = int.from_bytes(data[record + 2:record + 4], "big")
+        subtables[(platform, encoding)] = cmap + int.from_bytes(data[record + 4:record + 8], "big")
+    
+    for platform, encoding, fmt in _CMAP_PREFERENCE:
+        offset = subtables.get((platform, encoding))
+        if offset is None or int.from_bytes(data[offset:offset + 2], "big") != fmt:
+            continue
+        ranges = (_parse_cmap_format12 if fmt == 12 else _parse_cmap_format4)(data, offset)
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(item) for item in merged]
+    return None
+
+def read_font_coverage(font_path):
+    """读取字体文件中每个字形集的字符覆盖，返回列表（下标为字形集序号，无法解析的为 None）"""
+    # 以内存映射方式读取，只有文件头、表目录和 cmap 所在的页会真正从磁盘读入
+    with open(font_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:4] == b"ttcf":
+                count = int.from_bytes(data[8:12], "big")
+                offsets = [int.from_bytes(data[12 + 4 * i:16 + 4 * i], "big") for i in range(count)]
+            else:
+                offsets = [0]
+            
+            faces = []
+            for offset in offsets:
+                try:
+                    faces.append(read_cmap_coverage(data, offset))
+                except (IndexError, ValueError):
+                    faces.append(None)
+    return faces
+
+class FontIndex:
+    """系统字体的字符覆盖索引
+    
+    扫描字体目录，解析每个字体文件各字形集的 cmap，按文件的 mtime 和大小增量更新，
+    并缓存到 FONT_INDEX_PATH；之后启动只需读取缓存并比对文件状态。
+    """
+    
+    def __init__(self, path=FONT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._dirs = None
+        self._files = {}        # 路径 -> {"mtime_ns", "size", "faces": [区间列表或 None]}
+        self._faces = []        # [(路径, 字形集序号)]，按优先顺序排列
+        self._coverage = {}     # (路径, 序号) -> (起点数组, 终点数组)
+        self._char_masks = OrderedDict()
+    
+    def _scan_files(self, dirs):
+        """遍历字体目录，返回 {路径: os.stat 结果}"""
+        found = {}
+        for root_dir in dirs:
+            for root, _, names in os.walk(root_dir):
+                for name in names:
+                    if name.lower().endswith(FONT_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        try:
+                            found[path] = os.stat(path)
+                        except OSError:
+                            pass
+        return found
+    
+    def load(self, extra_dirs=()):
+        """载入缓存并与字体目录比对，只重新解析新增或修改过的文件；目录不变时直接返回"""
+        dirs = tuple(system_font_dirs()) + tuple(extra_dirs or ())
+        with self._lock:
+            if dirs == self._dirs:
+                return
+            
+            cached = {}
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+                if index.get("version") == FONT_INDEX_VERSION:
+                    cached = index["files"]
+            except (OSError, ValueError, KeyError, AttributeError):
+                pass
+            
+            files = {}
+            changed = False
+            for path, stat in self._scan_files(dirs).items():
+                entry = cached.get(path)
+                if (entry is None or entry.get("mtime_ns") != stat.st_mtime_ns
+                        or entry.get("size") != stat.st_size):
+                    with _timed("font_index"):
+                        try:
+                            faces = read_font_coverage(path)
+                        except (OSError, IndexError, ValueError):
+                            faces = []
+                    entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                             "faces": [[list(item) for item in ranges] if ranges else None
+                                       for ranges in faces]}
+                    changed = True
+                files[path] = entry
+            # 缓存中保留其他目录组合扫描到的字体，已删除的文件才移除
+            for path, entry in cached.items():
+                if path not in files and os.path.exists(path):
+                    files.setdefault(path, entry)
+                elif path not in files:
+                    changed = True
+            
+            if changed:
+                self._save(files)
+            self._dirs = dirs
+            self._files = {path: entry for path, entry in files.items()
+                           if any(path.startswith(os.path.join(d, "")) for d in dirs)}
+            self._rebuild()
+    
+    def _save(self, files):
+        """原子地写入缓存；缓存目录不可写时只在内存中使用"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # 多个工作进程可能同时首次扫描，各自写临时文件，避免互相覆盖出残缺的缓存
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": FONT_INDEX_VERSION, "files": files}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"无法写入字体索引缓存: {str(e)}")
+    
+    def _rebuild(self):
+        """按优先列表整理字形集顺序，并把覆盖区间转为数组以便二分查找"""
+        preferred = {name.lower(): rank for rank, name in enumerate(CHINESE_FONTS + ENGLISH_FONTS)}
+        faces = []
+        self._coverage.clear()
+        for path, entry in self._files.items():
+            for index, ranges in enumerate(entry["faces"]):
+                if ranges:
+                    face = (path, index)
+                    faces.append(face)
+                    self._coverage[face] = (array("L", (start for start, _ in ranges)),
+                                            array("L", (end for _, end in ranges)))
+        faces.sort(key=lambda face: (preferred.get(os.path.basename(face[0]).lower(), len(preferred)),
+                                     face))
+        self._faces = faces
+        self._char_masks.clear()
+    
+    def find(self, filename):
+        """按文件名（不区分大小写）查找已索引的字体路径"""
+        with self._lock:
+            name = filename.lower()
+            for path in self._files:
+                if os.path.basename(path).lower() == name:
+                    return path
+        return None
+    
+    def coverage(self, face):
+        """返回字形集的覆盖数组；不在索引中的字体（如自定义路径）按需解析，无法解析时返回 None"""
+        path, index = face if isinstance(face, tuple) else (face, 0)
+        with self._lock:
+            key = (path, index)
+            if key not in self._coverage:
+                try:
+                    ranges = read_font_coverage(path)[index]
+                except (OSError, IndexError, ValueError):
+                    ranges = None
+                self._coverage[key] = ranges and (array("L", (start for start, _ in ranges)),
+                                                  array("L", (end for _, end in ranges)))
+            return self._coverage[key]
+    
+    @staticmethod
+    def _covers(coverage, code):
+        starts, ends = coverage
+        i = bisect_right(starts, code) - 1
+        return i >= 0 and code <= ends[i]
+    
+    def missing(self, text, face):
+        """返回文本中该字体没有字形的字符（忽略空白和控制字符）；覆盖未知的字体视为不缺字"""
+        coverage = self.coverage(face)
+        if coverage is None:
+            return set()
+        return {char for char in set(text)
+                if char.isprintable() and not char.isspace() and not self._covers(coverage, ord(char))}
+    
+    def _char_mask(self, char):
+        """返回覆盖该字符的字形集位图（第 k 位对应优先顺序中的第 k 个字形集）"""
+        mask = self._char_masks.get(char)
+        if mask is None:
+            code = ord(char)
+            mask = 0
+            for bit, face in enumerate(self._faces):
+                if self._covers(self._coverage[face], code):
+                    mask |= 1 << bit
+            self._char_masks[char] = mask
+            while len(self._char_masks) > FALLBACK_CACHE_SIZE:
+                self._char_masks.popitem(last=False)
+        return mask
+    
+    def fallback(self, text, face):
+        """为缺字的文本挑选字形集：优先选覆盖全部字符的，否则选覆盖最多的；都不覆盖时返回 face"""
+        with self._lock:
+            chars = [char for char in set(text) if char.isprintable() and not char.isspace()]
+            masks = [self._char_mask(char) for char in chars]
+            common = -1
+            for mask in masks:
+                common &= mask
+            if common > 0:
+                choice = self._faces[(common & -common).bit_length() - 1]
+            else:
+                # 没有字体能覆盖全部字符时，只有覆盖得比原字体多才换
+                coverage = self.coverage(face) if face[0] else None
+                best_count = sum(self._covers(coverage, ord(char)) for char in chars) if coverage else 0
+                choice = face
+                for bit, candidate in enumerate(self._faces):
+                    count = sum((mask >> bit) & 1 for mask in masks)
+                    if count > best_count:
+                        best_count, choice = count, candidate
+            return choice
+
+    def fallback_map(self, text, face):
+        """为主字体缺少的字符挑选字形集，返回按字形集分组的 ((字符, 字形集), ...)
+        
+        缺少的字符都能由同一个字形集覆盖时只用这一个，否则逐字选优先顺序中第一个
+        覆盖它的字形集；没有任何字体覆盖的字符仍交给主字体。
+        """
+        with self._lock:
+            missing = sorted(self.missing(text, face))
+            masks = [self._char_mask(char) for char in missing]
+            common = -1
+            for mask in masks:
+                common &= mask
+            groups = {}
+            for char, mask in zip(missing, masks):
+                pick = common if common > 0 else mask
+                if pick:
+                    groups.setdefault(self._faces[(pick & -pick).bit_length() - 1], []).append(char)
+            return tuple(("".join(chars), candidate) for candidate, chars in sorted(groups.items()))
+
+font_index = FontIndex()
+
+# 按字符回退的字体组合：主字体（路径或 (路径, 序号)），以及 ((缺字, 回退字形集), ...)
+FontStack = namedtuple("FontStack", "primary fallbacks")
+
+class FallbackFont:
+    """按字符回退的组合字体：主字体缺少的字符改用回退字体，按同一字体的连续片段测量和绘制
+    
+    各片段与主字体的基线对齐，起点取整到像素；提供排版用到的 getlength、getbbox、
+    getmetrics 和 size，可以像普通字体一样交给 text_wrap、measure_line 和 draw_text_line。
+    """
+    
+    def __init__(self, primary, fonts):
+        self.primary = primary
+        self.fonts = fonts      # 字符 -> 回退字体
+        self.size = primary.size
+        self._ascent = primary.getmetrics()[0]
+    
+    def getmetrics(self):
+        return self.primary.getmetrics()
+    
+    def runs(self, text):
+        """按所用字体切分文本，返回 [(片段, 字体, x 偏移, y 偏移)]，偏移相对于行的左上角"""
+        groups = []
+        for char in text:
+            font = self.fonts.get(char, self.primary)
+            if groups and groups[-1][1] is font:
+                groups[-1][0].append(char)
+            else:
+                groups.append(([char], font))
+        
+        runs = []
+        pen = 0
+        for chars, font in groups:
+            run = "".join(chars)
+            offset = round(pen)
+            runs.append((run, font, offset, self._ascent - font.getmetrics()[0]))
+            pen = offset + font.getlength(run)
+        return runs
+    
+    def getlength(self, text, *args, **kwargs):
+        runs = self.runs(text)
+        if not runs:
+            return 0
+        run, font, offset, _ = runs[-1]
+        return offset + font.getlength(run)
+    
+    def getbbox(self, text, *args, **kwargs):
+        box = None
+        for run, font, offset_x, offset_y in self.runs(text):
+            left, top, right, bottom = font.getbbox(run)
+            run_box = (offset_x + left, offset_y + top, offset_x + right, offset_y + bottom)
+            if box is None:
+                box = run_box
+            else:
+                box = (min(box[0], run_box[0]), min(box[1], run_box[1]),
+                       max(box[2], run_box[2]), max(box[3], run_box[3]))
+        return box or self.primary.getbbox(text)
+
+def font_for_text(text, font_path, config=None):
+    """返回渲染该文本所用的字体：配置的字体缺字时，只有缺少的字符按覆盖索引改用其他字体
+    
+    不缺字时原样返回 font_path；缺字时返回 FontStack，其余字符仍用配置的字体。
+    没有可用的主字体时才整条换用索引中覆盖最多的字体（路径，或 .ttc 中非首个
+    字形集的 (路径, 序号)）。返回值都可直接传给 get_font。
+    """
+    if config is None:
+        config = current_config
+    if not config.get("FONT_FALLBACK", True):
+        return font_path
+    
+    face = font_path if isinstance(font_path, tuple) else (font_path, 0)
+    if font_path and not font_index.missing(text, face):
+        return font_path
+    
+    with _timed("font_resolve"):
+        font_index.load(config.get("FONT_DIRS"))
+        if font_path:
+            fallbacks = font_index.fallback_map(text, face)
+            choice = face
+        else:
+            fallbacks = None
+            choice = font_index.fallback(text, face)
+    if fallbacks:
+        _count("font_fallbacks")
+        return FontStack(font_path, fallbacks)
+    if choice == face:
+        return font_path
+    _count("font_fallbacks")
+    return choice[0] if choice[1] == 0 else choice
+
+def get_system_font(custom_path=None):
+    """获取系统字体，优先使用自定义字体"""
+    with _timed("font_resolve"):
+        return font_registry.resolve(custom_path)
+
 def get_text_size(draw, text, font):
     """计算文本尺寸（兼容不同Pillow版本）"""
+    _count("measure_calls")
     try:
         left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
         return (right - left, bottom - top)
@@ -72,137 +1077,804 @@ def get_text_size(draw, text, font):
         except:
             return (len(text) * font.size, font.size)
 
+def measure_line(draw, text, font):
+    """测量一行文本的 (宽, 高)：优先用逐字度量缓存拼出，拼不出时再整行测量"""
+    metrics = font_registry.metrics(font)
+    if metrics is not None:
+        size = metrics.line_size(text)
+        if size is not None:
+            return size
+    return get_text_size(draw, text, font)
+
 def get_multiline_height(draw, text, font, spacing=1.2):
     """计算多行文本的总高度"""
-    lines = text.split('\n')
+    return _block_height([get_text_size(draw, line, font) for line in text.split('\n')], spacing)
+
+def _block_height(line_sizes, spacing=1.2):
+    """根据已测量的各行尺寸计算多行文本的总高度"""
     total_height = 0
-    for line in lines:
-        _, height = get_text_size(draw, line, font)
+    for _, height in line_sizes:
         total_height += height * spacing
     return total_height
 
-def calculate_font_size(draw, text, font_path, max_width, max_lines=5):
-    """自动调整字体大小以适应可用空间"""
-    font_size = current_config["BASE_FONT_SIZE"]
-    max_font_size = current_config["MAX_FONT_SIZE"]
-    min_font_size = current_config["MIN_FONT_SIZE"]
+def calculate_font_size(draw, text, font_path, max_width, max_lines=5, config=None):
+    """在 [MIN_FONT_SIZE, MAX_FONT_SIZE] 范围内二分查找能容纳文本的最大字号
+    
+    返回 (字体, 换行后的文本, 是否放得下)；放不下时退回最小字号。
+    """
+    with _timed("fit"):
+        font, wrapped_text, fitted, _ = _fit_font_size(draw, text, font_path, max_width,
+                                                       max_lines, config)
+    return font, wrapped_text, fitted
+
+def _fit_font_size(draw, text, font_path, max_width, max_lines=5, config=None,
+                   layout_cache=None):
+    """calculate_font_size 的实现，额外返回每行的 (宽, 高)，供排版复用
     
-    while font_size <= max_font_size:
+    layout_cache 为同一条名言的多个版本共享的字典，缓存断行片段以及 (字体, 字号, 换行宽度)
+    对应的换行结果和行尺寸，不同尺寸的版本落在相同字号和宽度上时不再重复测量。
+    """
+    if config is None:
+        config = current_config
+    if layout_cache is None:
+        layout_cache = {}
+    min_font_size = config["MIN_FONT_SIZE"]
+    max_font_size = max(config["MAX_FONT_SIZE"], min_font_size)
+    wrap_width = max_width - 2 * config["PADDING"]
+    # 预留给上下留白的高度；预览配置带有 LAYOUT_SCALE 时按比例缩小
+    max_height = (config["IMAGE_HEIGHT"] - 2 * config["PADDING"]
+                  - 80 * config.get("LAYOUT_SCALE", 1))
+    
+    # 断行机会与字号无关，整条名言只切分一次
+    segments = layout_cache.get("segments")
+    if segments is None:
+        segments = layout_cache["segments"] = break_segments(text)
+    
+    def try_size(font_size):
+        """按指定字号换行并判断行数、高度和行宽是否都放得下，换行与测量结果按字号和宽度缓存"""
+        key = (font_path, font_size, wrap_width)
+        entry = layout_cache.get(key)
+        if entry is None:
+            font = font_registry.get_font(font_path, font_size)
+            entry = layout_cache[key] = [font, text_wrap(draw, text, font, wrap_width, segments),
+                                         None]
+        font, wrapped_text, line_sizes = entry
+        fits = wrapped_text.count('\n') + 1 <= max_lines
+        if fits:
+            if line_sizes is None:
+                line_sizes = entry[2] = [measure_line(draw, line, font)
+                                         for line in wrapped_text.split('\n')]
+            # 无法断开的长单词会超出换行宽度，此时同样视为放不下，改用更小的字号
+            fits = (_block_height(line_sizes) < max_height
+                    and max(width for width, _ in line_sizes) <= wrap_width)
+        return font, wrapped_text, fits, line_sizes
+    
+    best = None
+    low, high = min_font_size, max_font_size
+    while low <= high:
+        font_size = (low + high) // 2
         try:
-            font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default()
-            
-            wrapped_text = text_wrap(draw, text, font, max_width - 2 * current_config["PADDING"])
-            lines = wrapped_text.split('\n')
-            
-            if len(lines) <= max_lines:
-                total_height = get_multiline_height(draw, wrapped_text, font)
-                
-                max_height = current_config["IMAGE_HEIGHT"] - 2 * current_config["PADDING"] - 80
-                if total_height < max_height:
-                    return font, wrapped_text
-                    
+            attempt = try_size(font_size)
         except Exception as e:
             print(f"字体大小调整时出错: {str(e)}")
+            attempt = None
         
-        font_size -= 2
+        if attempt and attempt[2]:
+            best = attempt
+            low = font_size + 1
+        else:
+            high = font_size - 1
+    
+    if best:
+        return best
+    
+    font, wrapped_text, _, line_sizes = try_size(min_font_size)
+    if line_sizes is None:
+        line_sizes = [measure_line(draw, line, font) for line in wrapped_text.split('\n')]
+    return font, wrapped_text, False, line_sizes
+
+def _extend_line(metrics, extent, segment):
+    """把片段接到行尾，返回新的 (前进宽度, 左边界, 右边界, 末字符)"""
+    advance, left, right = metrics.segment(segment)
+    if extent is None or extent[3] is None or not segment:
+        return advance, left, right, segment[-1] if segment else None
+    
+    pen, line_left, line_right, last_char = extent
+    offset = pen + metrics.kerning(last_char, segment[0])
+    return (offset + advance, min(line_left, offset + left),
+            max(line_right, offset + right), segment[-1])
+
+def _line_fits(draw, font, extent, pieces, max_width):
+    """根据累加的宽度判断一行是否放得下，接近临界值时再整行精确测量"""
+    if extent is not None:
+        width = extent[2] - extent[1]
+        if width <= max_width - WRAP_EXACT_MARGIN:
+            return True
+        if width > max_width + WRAP_EXACT_MARGIN:
+            return False
+    
+    width, _ = measure_line(draw, "".join(pieces), font)
+    return width <= max_width
+
+# 换行用的字符类别（UAX #14 的简化版）
+BREAK_AL = 0     # 字母、数字等：彼此之间不断行
+BREAK_ID = 1     # 汉字、假名、谚文等表意字符：前后都可断行
+BREAK_SP = 2     # 空格：在其后断行，行尾的空格不计入行宽
+BREAK_CL = 3     # 西文收尾标点 .,!?;:)]} 等：前面不断行，后面只在空格处断行
+BREAK_CLW = 4    # 全角收尾标点 ，。、！？）」』 等：前面不断行，后面可断行
+BREAK_NS = 5     # 小假名、长音符、迭字符等不能出现在行首的字符
+BREAK_OP = 6     # 西文开头标点 ([{ 等：后面不断行
+BREAK_OPW = 7    # 全角开头标点 （「『《 等：后面不断行，前面可断行
+BREAK_QU = 8     # 引号 " ' “ ” ‘ ’：前后都不断行（’ 也是英文的撇号，如 don’t）
+BREAK_HY = 9     # 连字符：后面紧跟字母时可断行
+BREAK_B2 = 10    # 破折号、省略号：连续出现时不拆开
+BREAK_CM = 11    # 组合附加符号、变体选择符：前面不断行
+
+# 基本多文种平面内每个码位的类别，按 ord() 直接下标查表
+BREAK_CLASSES = bytearray(0x10000)
+
+def _set_break_class(cls, *ranges):
+    for item in ranges:
+        if isinstance(item, str):
+            for char in item:
+                BREAK_CLASSES[ord(char)] = cls
+        else:
+            first, last = item
+            BREAK_CLASSES[first:last + 1] = bytes([cls]) * (last - first + 1)
+
+_set_break_class(BREAK_ID,
+                 (0x1100, 0x115F), (0x2E80, 0x2FFF), (0x3000, 0x303F), (0x3040, 0x30FF),
+                 (0x3100, 0x31FF), (0x3200, 0x4DBF), (0x4E00, 0x9FFF), (0xA960, 0xA97F),
+                 (0xAC00, 0xD7A3), (0xF900, 0xFAFF), (0xFE30, 0xFE4F), (0xFF01, 0xFF60),
+                 (0xFF66, 0xFFDC), (0xFFE0, 0xFFE6))
+_set_break_class(BREAK_SP, " \t\u3000\u200b")
+_set_break_class(BREAK_CL, ".,!?;:)]}%\u2030\u2032\u2033\u2103")
+_set_break_class(BREAK_CLW, "，。、！？：；）」』】〕〉》］｝〗〙〛｠．％｣､｡")
+_set_break_class(BREAK_NS, "ぁぃぅぇぉっゃゅょゎゕゖァィゥェォッャュョヮヵヶー々〻ゝゞヽヾ〜～・･ｧｨｩｪｫｬｭｮｯｰ",
+                 (0x31F0, 0x31FF))
+_set_break_class(BREAK_OP, "([{\u00a1\u00bf")
+_set_break_class(BREAK_OPW, "（「『【〔〈《［｛〖〘〚｟｢")
+_set_break_class(BREAK_QU, "\"'\u00ab\u00bb\u2018\u2019\u201c\u201d")
+_set_break_class(BREAK_HY, "-\u2010\u2013")
+_set_break_class(BREAK_B2, "\u2014\u2026\u2025")
+_set_break_class(BREAK_CM, (0x0300, 0x036F), (0x200C, 0x200D), (0x20D0, 0x20FF),
+                 (0xFE00, 0xFE0F), (0xFE20, 0xFE2F))
+
+# 这些类别之前不能断行 / 之后不能断行 / 与相邻字符之间默认可断行
+_NO_BREAK_BEFORE = frozenset((BREAK_SP, BREAK_CL, BREAK_CLW, BREAK_NS, BREAK_QU, BREAK_CM))
+_NO_BREAK_AFTER = frozenset((BREAK_OP, BREAK_OPW, BREAK_QU))
+_BREAK_AROUND = frozenset((BREAK_ID, BREAK_CLW, BREAK_NS, BREAK_OPW))
+
+def break_class(char):
+    """返回字符的换行类别；基本平面之外的表意文字和表情符号按 BREAK_ID 处理"""
+    code = ord(char)
+    if code < 0x10000:
+        return BREAK_CLASSES[code]
+    if 0x20000 <= code <= 0x3FFFD or 0x1F000 <= code <= 0x1FAFF:
+        return BREAK_ID
+    return BREAK_AL
+
+def break_segments(text):
+    """按断行机会把文本切成不可再分的片段，返回 [(正文, 其后的空格), ...]
+    
+    每条名言只切分一次，尝试不同字号时复用同一结果。
+    """
+    classes = [break_class(char) for char in text]
+    segments = []
+    start = 0
+    body_end = None      # 当前片段中空格开始的位置
+    last = None          # 上一个非空格字符的类别
+    for i in range(len(text)):
+        cls = classes[i]
+        if cls == BREAK_SP:
+            if body_end is None:
+                body_end = i
+            continue
         
-        if font_size < min_font_size:
-            break
+        if i > start and last is not None:
+            if body_end is not None:
+                # 空格之后可断行，除非后面是收尾标点或前面是开头标点
+                allowed = cls not in (BREAK_CL, BREAK_CLW) and last not in (BREAK_OP, BREAK_OPW)
+            elif cls in _NO_BREAK_BEFORE or last in _NO_BREAK_AFTER:
+                allowed = False
+            elif last == BREAK_B2 and cls == BREAK_B2:
+                allowed = False
+            elif last == BREAK_HY:
+                allowed = cls == BREAK_AL
+            else:
+                allowed = last in _BREAK_AROUND or cls in _BREAK_AROUND
             
-    font_size = min_font_size
-    font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default()
-    wrapped_text = text_wrap(draw, text, font, max_width - 2 * current_config["PADDING"])
+            if allowed:
+                end = body_end if body_end is not None else i
+                segments.append((text[start:end], text[end:i]))
+                start = i
+        
+        body_end = None
+        last = cls
     
-    return font, wrapped_text
+    if start < len(text):
+        end = body_end if body_end is not None else len(text)
+        segments.append((text[start:end], text[end:]))
+    return segments
 
-def text_wrap(draw, text, font, max_width):
-    """文本换行功能"""
+def text_wrap(draw, text, font, max_width, segments=None):
+    """文本换行功能：按断行机会逐段累加缓存的宽度，每个片段只测量一次
+    
+    segments 为 break_segments(text) 的结果，同一名言尝试多个字号时由调用方传入复用。
+    """
+    _count("wrap_attempts")
+    with _timed("wrap"):
+        if segments is None:
+            segments = break_segments(text)
+        return _text_wrap(draw, font, max_width, segments)
+
+def _extend_segment(metrics, extent, piece, body):
+    """把片段接到行尾；以表意字符或标点开头的片段逐字累加，复用单字的度量缓存
+    
+    字体没有字距调整时单词也逐字累加，无需再逐对测量，否则单词整体测量一次。
+    """
+    if len(body) > 1 and (not metrics.kerned or break_class(body[0]) != BREAK_AL):
+        for char in piece:
+            extent = _extend_line(metrics, extent, char)
+        return extent
+    return _extend_line(metrics, extent, piece)
+
+def _text_wrap(draw, font, max_width, segments):
     lines = []
+    metrics = font_registry.metrics(font)
     
-    if any(0x4E00 <= ord(c) <= 0x9FFF or 
-           0x3040 <= ord(c) <= 0x309F or 
-           0x30A0 <= ord(c) <= 0x30FF for c in text):
-        current_line = ""
-        for char in text:
-            test_line = current_line + char
-            width, _ = get_text_size(draw, test_line, font)
-            if width <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = char
-        if current_line:
-            lines.append(current_line)
-    else:
-        words = text.split(' ')
-        current_line = words[0] if words else ""
-        
-        for word in words[1:]:
-            test_line = current_line + " " + word
-            width, _ = get_text_size(draw, test_line, font)
-            if width <= max_width:
-                current_line = test_line
+    line = ""
+    extent = None
+    pending = ""    # 上一片段末尾的空格，只在下一片段接在同一行时才保留
+    for body, spaces in segments:
+        if not line:
+            line = body
+            extent = _extend_segment(metrics, None, body, body) if metrics and body else None
+        else:
+            piece = pending + body
+            test_extent = _extend_segment(metrics, extent, piece, body) if metrics else None
+            if _line_fits(draw, font, test_extent, [line, piece], max_width):
+                line += piece
+                extent = test_extent
             else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = word
-        if current_line:
-            lines.append(current_line)
+                lines.append(line)
+                line = body
+                extent = _extend_segment(metrics, None, body, body) if metrics else None
+        pending = spaces
+    if line:
+        lines.append(line)
     
     return '\n'.join(lines)
 
-def create_quote_image(quote, output_path=None):
-    """创建单张名言图片 - 移除了作者部分"""
-    # 从配置获取参数
-    width = current_config["IMAGE_WIDTH"]
-    height = current_config["IMAGE_HEIGHT"]
-    bg_color = current_config["BACKGROUND_COLOR"]
-    text_color = current_config["TEXT_COLOR"]
-    padding = current_config["PADDING"]
-    
-    # 创建画布
-    img = Image.new('RGB', (width, height), bg_color)
-    draw = ImageDraw.Draw(img)
-    
-    # 获取系统字体
-    font_path = get_system_font(current_config["FONT_PATH"])
+# 一条名言的排版结果：字体、各行文本、各行左上角坐标与 (宽, 高)、文本块总高度、是否放得下
+QuoteLayout = namedtuple("QuoteLayout", "font lines positions sizes total_height fitted")
+
+# 预渲染画布模板（背景 + 边框）的缓存上限
+CANVAS_TEMPLATE_CACHE_SIZE = 8
+
+_canvas_templates = OrderedDict()
+_canvas_templates_lock = threading.Lock()
+
+def _luma(color):
+    """按 Image.convert("L") 的 ITU-R 601-2 公式把 RGB 颜色换算为灰度"""
+    r, g, b = tuple(color)[:3]
+    return (r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16
+
+# 背景图片的缩放方式与渐变方向
+BACKGROUND_FITS = ("cover", "contain", "stretch", "tile")
+GRADIENT_DIRECTIONS = ("vertical", "horizontal", "diagonal")
+
+# 预处理后背景的磁盘缓存：原始 RGB 像素，各进程以内存映射方式读取，只解码缩放一次
+BACKGROUND_CACHE_DIR = os.path.join(_CACHE_ROOT, "quote-image", "backgrounds")
+BACKGROUND_CACHE_VERSION = 1
+BACKGROUND_CACHE_FILES = 32
+
+def background_spec(config):
+    """返回决定背景内容的配置与背景图片的文件状态，纯色背景时返回 None"""
+    image_path = config.get("BACKGROUND_IMAGE")
+    gradient = config.get("BACKGROUND_GRADIENT")
+    overlay = config.get("OVERLAY_COLOR")
+    opacity = float(config.get("OVERLAY_OPACITY") or 0)
+    if overlay is None or opacity <= 0:
+        overlay = None
+    if not image_path and gradient is None and overlay is None:
+        return None
+    
+    fit = config.get("BACKGROUND_FIT", "cover")
+    direction = config.get("GRADIENT_DIRECTION", "vertical")
+    if fit not in BACKGROUND_FITS:
+        raise ValueError(f"不支持的背景缩放方式: {fit}")
+    if direction not in GRADIENT_DIRECTIONS:
+        raise ValueError(f"不支持的渐变方向: {direction}")
+    
+    # 文件大小和修改时间参与缓存键，替换同名图片后会重新处理
+    image_id = None
+    if image_path:
+        image_path = os.path.abspath(image_path)
+        try:
+            stat = os.stat(image_path)
+            image_id = (image_path, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            image_id = (image_path, None, None)
+    return (image_id, fit if image_id else None,
+            tuple(gradient) if gradient is not None else None,
+            direction if gradient is not None else None,
+            (tuple(overlay), min(opacity, 1.0)) if overlay is not None else None)
+
+def _gradient_mask(size, direction):
+    """返回从 0 渐变到 255 的遮罩，由 256x256 的线性渐变缩放而来"""
+    mask = Image.linear_gradient("L")
+    if direction == "horizontal":
+        mask = mask.transpose(Image.Transpose.ROTATE_90)
+    elif direction == "diagonal":
+        mask = ImageChops.add(mask, mask.transpose(Image.Transpose.TRANSPOSE), scale=2.0)
+    return mask.resize(size, Image.Resampling.BILINEAR)
+
+def _open_background_image(image_path, size, fit):
+    """解码背景图片并按 EXIF 方向摆正；JPEG 用 draft 直接按接近目标的尺寸解码"""
+    source = Image.open(image_path)
+    if fit != "tile":
+        width, height = size
+        # EXIF 方向为旋转 90 度时，解码后的宽高与摆正后相反
+        if source.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+        source.draft("RGB", (width, height))
+    source = ImageOps.exif_transpose(source)
+    if source.mode in ("RGBA", "LA", "PA") or "transparency" in source.info:
+        return source.convert("RGBA")
+    return source.convert("RGB")
+
+def _build_background(width, height, bg_color, spec):
+    """按背景规格绘制 RGB 背景：纯色或渐变打底，铺上背景图片，再混合叠加层"""
+    image_id, fit, gradient, direction, overlay = spec
+    size = (width, height)
+    background = Image.new("RGB", size, tuple(bg_color))
+    if gradient is not None:
+        background = Image.composite(Image.new("RGB", size, gradient), background,
+                                     _gradient_mask(size, direction))
+    
+    if image_id is not None:
+        source = _open_background_image(image_id[0], size, fit)
+        mask = source if source.mode == "RGBA" else None
+        if fit == "cover":
+            layer = ImageOps.fit(source, size, Image.Resampling.LANCZOS)
+            background.paste(layer, (0, 0), layer if mask else None)
+        elif fit == "contain":
+            layer = ImageOps.contain(source, size, Image.Resampling.LANCZOS)
+            box = ((width - layer.width) // 2, (height - layer.height) // 2)
+            background.paste(layer, box, layer if mask else None)
+        elif fit == "stretch":
+            layer = source.resize(size, Image.Resampling.LANCZOS)
+            background.paste(layer, (0, 0), layer if mask else None)
+        else:
+            for top in range(0, height, source.height):
+                for left in range(0, width, source.width):
+                    background.paste(source, (left, top), mask)
+    
+    if overlay is not None:
+        color, opacity = overlay
+        background = Image.blend(background, Image.new("RGB", size, color), opacity)
+    return background
+
+def _background_cache_path(width, height, bg_color, spec):
+    """返回背景磁盘缓存文件路径，文件名为尺寸、背景色与背景规格的哈希"""
+    key = json.dumps([BACKGROUND_CACHE_VERSION, width, height, list(bg_color), spec])
+    return os.path.join(BACKGROUND_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".rgb")
+
+def _prune_background_cache():
+    """只保留最近使用的 BACKGROUND_CACHE_FILES 个背景缓存文件"""
+    entries = []
+    for entry in os.scandir(BACKGROUND_CACHE_DIR):
+        if entry.name.endswith(".rgb"):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+    entries.sort(reverse=True)
+    for _, path in entries[BACKGROUND_CACHE_FILES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def load_background(width, height, bg_color, spec):
+    """返回预处理好的 RGB 背景
     
-    # 自动调整字体大小和文本换行
-    quote_font, wrapped_quote = calculate_font_size(
-        draw, 
-        quote, 
-        font_path, 
-        width
-    )
+    优先以内存映射读取磁盘缓存（同一背景的进程共享页缓存，不必各自解码缩放）；
+    没有缓存时解码、缩放、转换颜色后写入缓存。缓存目录不可写时只在内存中复用。
+    """
+    path = _background_cache_path(width, height, bg_color, spec)
+    size = width * height * 3
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if len(mapped) == size:
+                    background = Image.frombytes("RGB", (width, height), mapped)
+                    try:
+                        os.utime(path)
+                    except OSError:
+                        pass
+                    return background
+    except (OSError, ValueError):
+        pass
+    
+    with _timed("background"):
+        background = _build_background(width, height, bg_color, spec)
+    try:
+        os.makedirs(BACKGROUND_CACHE_DIR, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(background.tobytes())
+        os.replace(temp_path, path)
+        _prune_background_cache()
+    except OSError:
+        pass
+    return background
+
+def get_canvas_template(width, height, bg_color, padding, mode="RGB", background=None):
+    """获取预先绘制好背景和边框的画布模板，调用方需 copy() 或 paste() 后再绘制
     
-    # 计算文本尺寸
-    quote_lines = wrapped_quote.split('\n')
-    total_quote_height = get_multiline_height(draw, wrapped_quote, quote_font)
+    mode 为 "L" 时按灰度绘制；为 "mask" 时是全黑的单通道画布，只用来承载文字遮罩。
+    background 为 background_spec() 的结果，不为 None 时以背景图片、渐变和叠加层打底。
+    """
+    if mode == "mask":
+        background = None
+    key = (width, height, tuple(bg_color), padding, mode, background)
+    with _canvas_templates_lock:
+        template = _canvas_templates.get(key)
+        if template is not None:
+            _canvas_templates.move_to_end(key)
+            return template
+        
+        if mode == "mask":
+            template = Image.new('L', (width, height), 0)
+        else:
+            if background is not None:
+                template = load_background(width, height, bg_color, background)
+                if mode == "L":
+                    template = template.convert("L")
+            elif mode == "L":
+                template = Image.new('L', (width, height), _luma(bg_color))
+            else:
+                template = Image.new('RGB', (width, height), tuple(bg_color))
+            outline = _luma((220, 220, 220)) if mode == "L" else (220, 220, 220)
+            # 添加装饰元素
+            ImageDraw.Draw(template).rectangle(
+                [(padding, padding), (width - padding, height - padding)],
+                outline=outline, width=2)
+        
+        _canvas_templates[key] = template
+        while len(_canvas_templates) > CANVAS_TEMPLATE_CACHE_SIZE:
+            _canvas_templates.popitem(last=False)
+        return template
+
+def canvas_for_config(config, mode="RGB"):
+    """按配置获取画布模板（背景、渐变、叠加层与边框）"""
+    return get_canvas_template(config["IMAGE_WIDTH"], config["IMAGE_HEIGHT"],
+                               config["BACKGROUND_COLOR"], config["PADDING"], mode,
+                               background_spec(config))
+
+def layout_quote(draw, quote, font_path, config=None, layout_cache=None):
+    """计算名言的字号、换行与每行的居中位置，每行只测量一次"""
+    if config is None:
+        config = current_config
+    width = config["IMAGE_WIDTH"]
+    height = config["IMAGE_HEIGHT"]
+    font_path = font_for_text(quote, font_path, config)
+    
+    with _timed("fit"):
+        font, wrapped_text, fitted, line_sizes = _fit_font_size(
+            draw, quote, font_path, width, config=config, layout_cache=layout_cache)
+    total_height = _block_height(line_sizes)
     
     # 计算总高度并居中定位
-    start_y = (height - total_quote_height) // 2
-    
-    # 绘制名言文本
-    current_y = start_y
-    for line in quote_lines:
-        line_width, line_height = get_text_size(draw, line, quote_font)
-        x = (width - line_width) // 2
-        draw.text((x, current_y), line, fill=text_color, font=quote_font)
+    positions = []
+    current_y = (height - total_height) // 2
+    for line_width, line_height in line_sizes:
+        positions.append(((width - line_width) // 2, current_y))
         current_y += line_height * 1.2
     
-    # 添加装饰元素
-    draw.rectangle([(padding, padding), (width - padding, height - padding)], 
-                  outline=(220, 220, 220), width=2)
+    return QuoteLayout(font, wrapped_text.split('\n'), positions, line_sizes,
+                       total_height, fitted)
+
+# 排版检查结果：放得下 / 退回最小字号后超出文字区域 / 超出画布、会被裁掉
+LAYOUT_FIT = "fit"
+LAYOUT_OVERFLOW = "overflow"
+LAYOUT_CLIPPED = "clipped"
+
+def check_layout(quote, font_path=None, config=None, draw=None):
+    """只做字号搜索和换行，不绘制、不编码，返回该名言的排版报告（字典）"""
+    if config is None:
+        config = current_config
+    if font_path is None:
+        font_path = get_system_font(config["FONT_PATH"])
+    if draw is None:
+        draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    
+    layout = layout_quote(draw, quote, font_path, config)
+    text_width = max((line_width for line_width, _ in layout.sizes), default=0)
+    # 无法断开的长单词在最小字号下仍可能比文字区域宽，宽度也要单独检查
+    if text_width > config["IMAGE_WIDTH"] or layout.total_height > config["IMAGE_HEIGHT"]:
+        status = LAYOUT_CLIPPED
+    elif not layout.fitted or text_width > config["IMAGE_WIDTH"] - 2 * config["PADDING"]:
+        status = LAYOUT_OVERFLOW
+    else:
+        status = LAYOUT_FIT
+    
+    return {
+        "status": status,
+        "font_size": getattr(layout.font, "size", None),
+        "lines": len(layout.lines),
+        "block_height": round(layout.total_height, 1),
+        "text_width": text_width,
+    }
+
+def encode_image(img, output_format=None, config=None):
+    """按配置的格式和编码参数把图片编码为字节串"""
+    if config is None:
+        config = current_config
+    if output_format is None:
+        output_format = config["OUTPUT_FORMAT"]
+    
+    buffer = io.BytesIO()
+    if output_format == "png":
+        colors = config.get("PNG_PALETTE_COLORS", 0)
+        if colors:
+            # 双色卡片只有背景到文字色之间的抗锯齿过渡，调色板足以无损表达
+            img = img.quantize(colors=min(int(colors), 256), method=Image.FASTOCTREE,
+                               dither=Image.NONE)
+        img.save(buffer, "PNG", compress_level=config.get("PNG_COMPRESS_LEVEL", 6))
+    elif output_format == "jpeg":
+        img.save(buffer, "JPEG", quality=config.get("JPEG_QUALITY", 90))
+    elif output_format == "webp":
+        img.save(buffer, "WEBP", quality=config.get("WEBP_QUALITY", 90),
+                 lossless=bool(config.get("WEBP_LOSSLESS", False)),
+                 method=config.get("WEBP_METHOD", 4))
+    else:
+        img.save(buffer, OUTPUT_FORMATS[output_format][0])
+    return buffer.getvalue()
+
+def save_image(img, output_path, config=None):
+    """编码并写入图片文件"""
+    with _timed("encode"):
+        data = encode_image(img, config=config)
+    with _timed("write"):
+        with open(output_path, "wb") as f:
+            f.write(data)
+
+class WriteBehind:
+    """后台编码写盘流水线：渲染线程提交图片后立即返回，编码和写盘各由一组线程处理
+    
+    渲染 -> 编码 -> 写盘 三段之间用有界队列连接，队列满时上游阻塞（背压）；
+    max_in_flight 限制已提交但尚未写完的图片总数，使内存占用与语料规模无关。
+    Pillow 编码时会释放 GIL，因此编码和磁盘 I/O 可以与下一条名言的渲染重叠。
+    """
     
-    # 保存图片
+    def __init__(self, max_pending=8, threads=1, config=None, write_threads=1, max_in_flight=None):
+        self.config = dict(current_config if config is None else config)
+        self.failures = []
+        self.encode_seconds = 0.0
+        self.write_seconds = 0.0
+        self._lock = threading.Lock()
+        self._encode_queue = queue.Queue(maxsize=max(1, max_pending))
+        self._write_queue = queue.Queue(maxsize=max(1, max_pending))
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._encoders = [threading.Thread(target=self._encode_loop, daemon=True)
+                          for _ in range(max(1, threads))]
+        self._writers = [threading.Thread(target=self._write_loop, daemon=True)
+                         for _ in range(max(1, write_threads))]
+        for thread in self._encoders + self._writers:
+            thread.start()
+    
+    def submit(self, img, output_path, config=None):
+        """提交一张图片，队列满或在途图片达到上限时阻塞（背压）；config 为 None 时使用创建时的配置"""
+        if self._in_flight is not None:
+            self._in_flight.acquire()
+        self._encode_queue.put((img, output_path, config))
+    
+    def _fail(self, output_path, error):
+        with self._lock:
+            self.failures.append((output_path, str(error)))
+        if self._in_flight is not None:
+            self._in_flight.release()
+    
+    def _encode_loop(self):
+        while True:
+            item = self._encode_queue.get()
+            try:
+                if item is None:
+                    return
+                img, output_path, config = item
+                started = time.perf_counter()
+                try:
+                    data = encode_image(img, config=config or self.config)
+                except Exception as e:
+                    self._fail(output_path, e)
+                    continue
+                with self._lock:
+                    self.encode_seconds += time.perf_counter() - started
+                self._write_queue.put((data, output_path))
+            finally:
+                self._encode_queue.task_done()
+    
+    def _write_loop(self):
+        while True:
+            item = self._write_queue.get()
+            try:
+                if item is None:
+                    return
+                data, output_path = item
+                started = time.perf_counter()
+                try:
+                    with open(output_path, "wb") as f:
+                        f.write(data)
+                except Exception as e:
+                    self._fail(output_path, e)
+                    continue
+                with self._lock:
+                    self.write_seconds += time.perf_counter() - started
+                if self._in_flight is not None:
+                    self._in_flight.release()
+            finally:
+                self._write_queue.task_done()
+    
+    def flush(self):
+        """等待已提交的图片全部写完，返回并清空期间的失败列表 [(路径, 错误)]"""
+        # 编码线程先把结果放入写盘队列再标记完成，因此依次等待两个队列即可
+        self._encode_queue.join()
+        self._write_queue.join()
+        with self._lock:
+            failures, self.failures = self.failures, []
+        return failures
+    
+    def take_timings(self):
+        """返回并清零后台线程累计的 (编码耗时, 写盘耗时)"""
+        with self._lock:
+            timings = (self.encode_seconds, self.write_seconds)
+            self.encode_seconds = self.write_seconds = 0.0
+        return timings
+    
+    def close(self):
+        """写完剩余图片并结束后台线程，返回失败列表"""
+        failures = self.flush()
+        for threads, stage_queue in ((self._encoders, self._encode_queue),
+                                     (self._writers, self._write_queue)):
+            for _ in threads:
+                stage_queue.put(None)
+            for thread in threads:
+                thread.join()
+        return failures
+
+def create_write_behind(config=None):
+    """按配置创建后台编码写盘流水线；WRITE_BEHIND 为 0 时返回 None，表示同步写盘"""
+    if config is None:
+        config = current_config
+    depth = config.get("WRITE_BEHIND", 0)
+    if depth <= 0:
+        return None
+    return WriteBehind(depth, config.get("ENCODE_THREADS", 1), config,
+                       write_threads=config.get("WRITE_THREADS", 1),
+                       max_in_flight=config.get("MAX_IN_FLIGHT", 0))
+
+# 当前生效的后台写盘器，为 None 时同步写盘
+_write_behind = None
+
+def create_quote_image(quote, output_path=None, font_path=None, config=None, layout_cache=None):
+    """创建单张名言图片 - 移除了作者部分
+    
+    config 为 None 时使用 current_config；传入配置快照时不读取全局配置，可并发调用。
+    """
+    # 从配置获取参数
+    if config is None:
+        config = current_config
+    text_color = tuple(config["TEXT_COLOR"])
+    
+    # 复制预渲染的画布（背景和边框）
+    with _timed("raster"):
+        img = canvas_for_config(config).copy()
+    
+    # 获取系统字体（批量模式下由调用方预先解析）
+    if font_path is None:
+        font_path = get_system_font(config["FONT_PATH"])
+    
+    _draw_quote(img, quote, font_path, config, text_color, layout_cache)
+    
+    # 保存图片：有后台写盘时只排队，立即返回继续渲染下一条
     if output_path:
-        img.save(output_path, "PNG")
+        if _write_behind is not None:
+            _write_behind.submit(img, output_path, None if config is current_config else config)
+        else:
+            save_image(img, output_path, config)
         print(f"已生成图片: {output_path}")
         return True
     
     return img
 
+def _draw_quote(img, quote, font_path, config, fill, layout_cache=None):
+    """在已铺好背景的画布上排版并绘制名言文本，返回排版结果"""
+    draw = ImageDraw.Draw(img)
+    
+    # 自动调整字体大小、文本换行并计算每行位置
+    layout = layout_quote(draw, quote, font_path, config, layout_cache)
+    if not layout.fitted:
+        print(f"警告: 名言过长，已使用最小字号 {config['MIN_FONT_SIZE']}: {quote[:30]}...")
+    if _stats is not None:
+        _stats.annotate(font_size=getattr(layout.font, "size", None),
+                        lines=len(layout.lines), fitted=layout.fitted)
+    
+    # 绘制名言文本
+    with _timed("raster"):
+        for line, position in zip(layout.lines, layout.positions):
+            draw_text_line(draw, position, line, layout.font, fill)
+    return layout
+
+def resolve_variants(variants=None, config=None):
+    """把版本列表解析为 [(版本名, 配置快照)]
+    
+    variants 可以是预设名列表（见 VARIANT_PRESETS），也可以是 {版本名: 配置覆盖项}
+    字典，覆盖项为空时使用同名预设；为 None 时取配置中的 VARIANTS。
+    """
+    if config is None:
+        config = current_config
+    if variants is None:
+        variants = config.get("VARIANTS") or []
+    if not isinstance(variants, dict):
+        variants = {name: None for name in variants}
+    
+    resolved = []
+    for name, overrides in variants.items():
+        if not overrides:
+            if name not in VARIANT_PRESETS:
+                raise ValueError(f"未知的版本: {name}")
+            overrides = VARIANT_PRESETS[name]
+        snapshot = dict(config)
+        snapshot.update(overrides)
+        for key in COLOR_KEYS:
+            if snapshot.get(key) is not None:
+                snapshot[key] = tuple(snapshot[key])
+        resolved.append((name, snapshot))
+    return resolved
+
+# 预览图的最长边（像素）
+PREVIEW_SIZE = 360
+
+def preview_config(config=None, max_side=PREVIEW_SIZE):
+    """按比例缩小尺寸、内边距和字号，得到用于快速预览的配置快照"""
+    if config is None:
+        config = current_config
+    snapshot = dict(config)
+    scale = min(1.0, max_side / max(config["IMAGE_WIDTH"], config["IMAGE_HEIGHT"]))
+    for key in ("IMAGE_WIDTH", "IMAGE_HEIGHT", "PADDING", "BASE_FONT_SIZE",
+                "MIN_FONT_SIZE", "MAX_FONT_SIZE"):
+        snapshot[key] = max(1, int(round(config[key] * scale)))
+    snapshot["LAYOUT_SCALE"] = scale
+    return snapshot
+
+def render_preview(quote, config=None, max_side=PREVIEW_SIZE):
+    """以缩小的分辨率渲染一条名言，用于调整参数时的实时预览"""
+    return create_quote_image(quote, config=preview_config(config, max_side))
+
+def render_variants(quote, variants=None, config=None, font_path=None):
+    """一次渲染同一条名言的多个尺寸/样式版本，返回 {版本名: Image}
+    
+    各版本共享已加载的字体、字形测量缓存和相同字号下的换行结果；每个版本使用
+    独立的配置快照，不修改 current_config。
+    """
+    if config is None:
+        config = current_config
+    if font_path is None:
+        font_path = get_system_font(config["FONT_PATH"])
+    
+    layout_cache = {}
+    images = {}
+    for name, variant_config in resolve_variants(variants, config):
+        variant_font = font_path
+        if variant_config["FONT_PATH"] != config["FONT_PATH"]:
+            variant_font = get_system_font(variant_config["FONT_PATH"])
+        images[name] = create_quote_image(quote, font_path=variant_font, config=variant_config,
+                                          layout_cache=layout_cache)
+    return images
+
 def parse_quotes(content):
     """解析名言文本 - 移除了作者部分"""
     quotes = []
@@ -219,47 +1891,1384 @@ def parse_quotes(content):
     
     return quotes
 
-def process_quotes_file(input_path, output_dir, status_label):
-    """处理输入文件并生成图片"""
+# 检测编码时读取的样本字节数
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# 并行模式下每个任务包含的名言条数，以及每个进程允许排队的任务数
+PARALLEL_CHUNK_SIZE = 8
+PARALLEL_TASKS_PER_WORKER = 4
+
+def detect_encoding(input_path, sample_size=ENCODING_SAMPLE_SIZE):
+    """读取文件开头的有限样本判断编码，依次尝试 utf-8、gbk，最后退回 latin-1"""
+    with open(input_path, 'rb') as f:
+        sample = f.read(sample_size)
+    
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    
+    # 样本可能截断在多字节字符中间，未读完时不要求以完整字符结尾
+    final = len(sample) < sample_size
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    
+    return 'latin-1'
+
+def iter_quotes(input_path, encoding=None):
+    """逐行流式读取名言，内存占用与文件大小无关"""
+    if encoding is None:
+        encoding = detect_encoding(input_path)
+    
+    # 样本之后仍可能出现无法解码的字节，替换掉而不是中断整个批次
+    with open(input_path, 'r', encoding=encoding, errors='replace') as f:
+        for line in f:
+            quote_text = line.strip()
+            if quote_text:
+                yield quote_text
+
+# 工作进程内的字体状态，每个进程只解析一次
+_worker_font_path = None
+
+# 批量生成时的多版本输出 [(版本名, 配置快照)]，为 None 时只按当前配置输出
+_variants = None
+
+def _init_worker(config, collect_stats=False, variants=None):
+    """进程池初始化：同步主进程配置，预先解析字体并启动后台写盘线程"""
+    global _worker_font_path, _stats, _write_behind, _variants
+    current_config.clear()
+    current_config.update(config)
+    _variants = variants
+    _stats = RenderStats(keep_quotes=False) if collect_stats else None
+    _worker_font_path = get_system_font(current_config["FONT_PATH"])
+    _write_behind = create_write_behind()
+
+def _render_one(quote, output_path, font_path, payload=None):
+    """渲染单条名言，返回 (是否成功, 错误信息, 错误堆栈, 统计记录, 输出数据)
+    
+    payload 为 None 时直接写入 output_path；为 "encoded" 时返回编码后的字节串，
+    为 "image" 时返回 Image 对象，交给调用方的输出目标处理。
+    """
+    if _stats is not None:
+        _stats.start_quote()
+    data = None
+    try:
+        if _variants:
+            ok = _render_variant_files(quote, output_path, font_path)
+        elif payload is None:
+            ok = bool(create_quote_image(quote, output_path=output_path, font_path=font_path))
+        else:
+            data = create_quote_image(quote, font_path=font_path)
+            if payload == "encoded":
+                with _timed("encode"):
+                    data = encode_image(data)
+            ok = True
+        result = [ok, None, None]
+    except Exception as e:
+        result = [False, str(e), traceback.format_exc()]
+    record = _stats.finish_quote() if _stats is not None else None
+    return (*result, record, data)
+
+def _variant_path(output_path, name, config):
+    """多版本输出时单个版本的文件路径：输出目录/版本名/文件名"""
+    output_dir, filename = os.path.split(output_path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(output_dir, name, f"{stem}.{OUTPUT_FORMATS[config['OUTPUT_FORMAT']][1]}")
+
+def _output_paths(output_path, variants=None):
+    """返回一条名言实际写出的全部文件路径；多版本输出时为各版本子目录中的文件"""
+    if not variants:
+        return [output_path]
+    return [_variant_path(output_path, name, config) for name, config in variants]
+
+def _render_variant_files(quote, output_path, font_path):
+    """渲染一条名言的全部版本并分别写入各版本的子目录，共享换行与测量结果"""
+    layout_cache = {}
+    for name, config in _variants:
+        variant_font = font_path
+        if config["FONT_PATH"] != current_config["FONT_PATH"]:
+            variant_font = get_system_font(config["FONT_PATH"])
+        create_quote_image(quote, output_path=_variant_path(output_path, name, config),
+                           font_path=variant_font, config=config, layout_cache=layout_cache)
+    return True
+
+def _render_worker(tasks):
+    """在工作进程中渲染一组名言，返回每条的 (是否成功, 错误信息, 错误堆栈, 统计记录, 输出数据)"""
+    results = [_render_one(quote, output_path, _worker_font_path, payload)
+               for quote, output_path, payload in tasks]
+    if _write_behind is None:
+        return results
+    
+    # 整组写完后再返回，写盘失败的名言标记为失败
+    failures = dict(_write_behind.flush())
+    for k, (_, output_path, _) in enumerate(tasks):
+        for path in _output_paths(output_path, _variants):
+            if path in failures:
+                results[k] = (False, failures[path], "", results[k][3], None)
+    
+    # 后台线程的编码/写盘耗时计入本组最后一条名言的记录
+    encode_seconds, write_seconds = _write_behind.take_timings()
+    record = results[-1][3] if results else None
+    if record is not None:
+        stages = record["stages"]
+        stages["encode"] = stages.get("encode", 0.0) + encode_seconds
+        stages["write"] = stages.get("write", 0.0) + write_seconds
+    return results
+
+def _iter_chunks(items, size):
+    """把可迭代对象按固定大小切分为列表"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _parallel_window(workers, max_in_flight=0):
+    """返回 (每组名言数, 最多排队的组数)
+    
+    max_in_flight 大于 0 时，已提交但尚未取回结果的名言总数不超过它；在此范围内
+    尽量让每个进程有一组在渲染、一组在排队。
+    """
+    chunk_size, max_pending = PARALLEL_CHUNK_SIZE, workers * PARALLEL_TASKS_PER_WORKER
+    if max_in_flight > 0:
+        chunk_size = max(1, min(chunk_size, max_in_flight // (2 * workers)))
+        max_pending = max(1, min(max_pending, max_in_flight // chunk_size))
+    return chunk_size, max_pending
+
+def _render_parallel(tasks, workers, on_result, payload=None, variants=None, cancelled=None):
+    """使用进程池并行生成图片，限制排队任务数，并按原顺序回调 on_result(序号, 是否成功, 输出数据)
+    
+    cancelled() 返回 True 时取消尚未开始的任务，只等待正在渲染的任务结束。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    chunk_size, max_pending = _parallel_window(workers, current_config.get("MAX_IN_FLIGHT", 0))
+    pending = deque()
+    
+    def report(chunk, future):
+        """按顺序输出一组任务的处理结果"""
+        for (i, quote, _), (ok, error, error_trace, record, data) in zip(chunk, future.result()):
+            print(f"处理 {i+1}: {quote[:30]}...")
+            if error is not None:
+                print(f"生成第 {i+1} 条名言时出错: {error}")
+                print(error_trace, end="")
+            if record is not None:
+                record["index"] = i
+                _stats.add_record(record)
+            on_result(i, ok, data)
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(dict(current_config), _stats is not None,
+                                       variants)) as executor:
+        for chunk in _iter_chunks(tasks, chunk_size):
+            pending.append((chunk, executor.submit(
+                _render_worker, [(quote, path, payload) for _, quote, path in chunk])))
+            if len(pending) >= max_pending:
+                report(*pending.popleft())
+        if cancelled is not None and cancelled():
+            pending = deque(item for item in pending if not item[1].cancel())
+        while pending:
+            report(*pending.popleft())
+
+def _render_sequential(tasks, font_path, on_result, payload=None):
+    """在当前进程中逐条生成图片，并回调 on_result(序号, 是否成功, 输出数据)"""
+    for i, quote, output_path in tasks:
+        print(f"处理 {i+1}: {quote[:30]}...")
+        ok, error, error_trace, record, data = _render_one(quote, output_path, font_path, payload)
+        if error is not None:
+            print(f"生成第 {i+1} 条名言时出错: {error}")
+            print(error_trace, end="")
+        if record is not None:
+            record["index"] = i
+            _stats.add_record(record)
+        on_result(i, ok, data)
+
+# 批量渲染到数组时的输出模式 -> 每像素字节数：RGB 彩色、L 灰度、mask 只有文字遮罩
+BATCH_MODES = {"RGB": 3, "L": 1, "mask": 1}
+
+# 按 (模式, 宽, 高) 复用的画布，每条名言只把模板贴回去，不再新建图片；
+# 每个线程各用一份，多个线程同时调用 render_batch 时互不干扰
+_batch_canvases = threading.local()
+
+def batch_shape(count, mode="RGB", config=None):
+    """返回 render_batch 输出数组的形状：RGB 为 (N, H, W, 3)，单通道模式为 (N, H, W)"""
+    if config is None:
+        config = current_config
+    if mode not in BATCH_MODES:
+        raise ValueError(f"不支持的批量输出模式: {mode}")
+    shape = (count, config["IMAGE_HEIGHT"], config["IMAGE_WIDTH"])
+    return shape + (3,) if BATCH_MODES[mode] == 3 else shape
+
+def _render_into(buffer, offset, quote, mode, font_path, config):
+    """把一条名言渲染到复用的画布上，再把像素直接写入缓冲区的指定位置"""
+    size = (config["IMAGE_WIDTH"], config["IMAGE_HEIGHT"])
+    template = canvas_for_config(config, mode)
+    canvases = getattr(_batch_canvases, "canvases", None)
+    if canvases is None:
+        canvases = _batch_canvases.canvases = {}
+    canvas = canvases.get((mode, size))
+    if canvas is None:
+        canvas = canvases[(mode, size)] = Image.new(template.mode, size)
+    with _timed("raster"):
+        canvas.paste(template)
+    
+    if mode == "mask":
+        fill = 255
+    elif mode == "L":
+        fill = _luma(config["TEXT_COLOR"])
+    else:
+        fill = tuple(config["TEXT_COLOR"])
+    _draw_quote(canvas, quote, font_path, config, fill)
+    
+    data = canvas.tobytes()
+    buffer[offset:offset + len(data)] = data
+
+def _attach_shared_memory(name):
+    """在工作进程中按名称打开共享内存；块由调用方创建和释放，本进程不负责回收"""
+    from multiprocessing import shared_memory
+    
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数；工作进程与主进程共用资源回收进程，重复登记无副作用
+        return shared_memory.SharedMemory(name=name)
+
+def _batch_worker(name, start, quotes, mode):
+    """在工作进程中把一组名言写入共享内存块，从第 start 帧开始"""
+    block = _attach_shared_memory(name)
+    try:
+        frame = current_config["IMAGE_WIDTH"] * current_config["IMAGE_HEIGHT"] * BATCH_MODES[mode]
+        for k, quote in enumerate(quotes):
+            _render_into(block.buf, (start + k) * frame, quote, mode, _worker_font_path,
+                         current_config)
+    finally:
+        block.close()
+    return len(quotes)
+
+def render_batch(quotes, out=None, mode="RGB", config=None, workers=None, font_path=None):
+    """把一批名言直接渲染进预先分配的 uint8 缓冲区，不返回逐张的 Image，也不编码
+    
+    out 可以是形状为 batch_shape(N, mode) 的 uint8 NumPy 数组、
+    multiprocessing.shared_memory.SharedMemory，或任意可写的连续缓冲区
+    （bytearray、memoryview 等，至少 N*H*W*通道数 字节）；为 None 时分配一个
+    NumPy 数组（需要安装 numpy）。mode 见 BATCH_MODES。返回 out 或新分配的数组。
+    
+    workers 大于 1 时工作进程直接写入共享内存：out 本身是 SharedMemory 时零拷贝，
+    否则先写入临时共享内存块，最后一次性复制到 out。
+    """
+    if config is None:
+        config = current_config
+    quotes = list(quotes)
+    shape = batch_shape(len(quotes), mode, config)
+    frame = shape[1] * shape[2] * BATCH_MODES[mode]
+    
+    if out is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("render_batch 未传入 out 时需要 numpy，也可以传入 bytearray 或共享内存")
+        out = numpy.zeros(shape, dtype=numpy.uint8)
+    if not quotes:
+        return out
+    
+    shared_name = getattr(out, "name", None) if hasattr(out, "buf") else None
+    buffer = memoryview(out.buf if shared_name else out)
+    if buffer.readonly:
+        raise ValueError("输出缓冲区不可写")
+    if buffer.ndim > 1 and (buffer.format != "B" or tuple(buffer.shape) not in
+                            (shape, shape + (1,))):
+        raise ValueError(f"输出数组应为 uint8 且形状为 {shape}，实际为 {buffer.format} {buffer.shape}")
+    if not buffer.c_contiguous:
+        raise ValueError("输出缓冲区必须是连续内存")
+    buffer = buffer.cast("B")
+    if len(buffer) < len(quotes) * frame:
+        raise ValueError(f"输出缓冲区至少需要 {len(quotes) * frame} 字节，实际为 {len(buffer)}")
+    
+    if workers is None:
+        workers = config.get("WORKERS", 1)
+    workers = max(1, min(int(workers), len(quotes)))
+    
+    if workers == 1:
+        if font_path is None:
+            font_path = get_system_font(config["FONT_PATH"])
+        for i, quote in enumerate(quotes):
+            _render_into(buffer, i * frame, quote, mode, font_path, config)
+        return out
+    
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+    
+    # 先在主进程中准备好背景，工作进程从磁盘缓存映射读取
+    canvas_for_config(config, mode)
+    
+    block = None
+    if shared_name is None:
+        block = shared_memory.SharedMemory(create=True, size=len(quotes) * frame)
+        shared_name = block.name
+    try:
+        # 每个进程分几组，兼顾负载均衡和提交开销
+        chunk_size = max(1, -(-len(quotes) // (workers * PARALLEL_TASKS_PER_WORKER)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(dict(config, WRITE_BEHIND=0),)) as executor:
+            futures = [executor.submit(_batch_worker, shared_name, start,
+                                       quotes[start:start + chunk_size], mode)
+                       for start in range(0, len(quotes), chunk_size)]
+            for future in futures:
+                future.result()
+        if block is not None:
+            buffer[:len(quotes) * frame] = block.buf[:len(quotes) * frame]
+    finally:
+        if block is not None:
+            block.close()
+            block.unlink()
+    return out
+
+# 输出方式：dir 逐张写文件，zip/tar 流式写入单个归档，sprite 拼接为精灵图
+OUTPUT_SINKS = ("dir", "zip", "tar", "sprite")
+
+# 归档与精灵图索引的格式版本
+SINK_INDEX_VERSION = 1
+
+class ArchiveSink:
+    """把编码后的图片按顺序流式写入单个 zip 或 tar 归档，关闭时在归档内写入 index.json"""
+    payload = "encoded"
+    
+    def __init__(self, output_dir, kind="zip"):
+        self.kind = kind
+        self.path = os.path.join(output_dir, f"quotes.{kind}")
+        self.members = {}
+        if kind == "zip":
+            # 图片本身已压缩，归档只做存储
+            self._archive = zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED, allowZip64=True)
+        else:
+            self._archive = tarfile.open(self.path, "w")
+    
+    def _write_member(self, name, data):
+        if self.kind == "zip":
+            self._archive.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._archive.addfile(info, io.BytesIO(data))
+    
+    def add(self, index, name, data):
+        """写入第 index 条名言（从 0 开始）的图片"""
+        self._write_member(name, data)
+        self.members[str(index + 1)] = name
+    
+    def close(self):
+        """写入索引（名言序号 -> 成员名）并关闭归档"""
+        index = {"version": SINK_INDEX_VERSION, "members": self.members}
+        self._write_member("index.json", json.dumps(index, ensure_ascii=False, indent=1).encode("utf-8"))
+        self._archive.close()
+
+class SpriteSheetSink:
+    """把图片按网格拼接为精灵图，关闭时写出 sprites_index.json 记录每条名言的图集坐标"""
+    payload = "image"
+    
+    def __init__(self, output_dir, columns=4, rows=4, config=None):
+        self.output_dir = output_dir
+        self.columns = max(1, int(columns))
+        self.rows = max(1, int(rows))
+        self.config = dict(current_config if config is None else config)
+        self.extension = OUTPUT_FORMATS[self.config["OUTPUT_FORMAT"]][1]
+        self.index = {}
+        self._sheet = None
+        self._sheet_number = 0
+        self._slot = 0
+        self._cell = None
+    
+    def _sheet_name(self):
+        return f"sprites_{self._sheet_number + 1:03d}.{self.extension}"
+    
+    def add(self, index, name, img):
+        """把第 index 条名言（从 0 开始）的图片放入当前图集，图集满时写出"""
+        if self._sheet is not None and img.size != self._cell:
+            self._flush_sheet()
+        if self._sheet is None:
+            self._cell = img.size
+            self._sheet = Image.new("RGB", (self._cell[0] * self.columns, self._cell[1] * self.rows),
+                                    tuple(self.config["BACKGROUND_COLOR"]))
+            self._slot = 0
+        
+        x = (self._slot % self.columns) * self._cell[0]
+        y = (self._slot // self.columns) * self._cell[1]
+        self._sheet.paste(img, (x, y))
+        self.index[str(index + 1)] = {"sheet": self._sheet_name(), "x": x, "y": y,
+                                      "width": self._cell[0], "height": self._cell[1]}
+        
+        self._slot += 1
+        if self._slot >= self.columns * self.rows:
+            self._flush_sheet()
+    
+    def _flush_sheet(self):
+        """写出当前图集，未填满的图集裁掉空行"""
+        if self._sheet is None:
+            return
+        used_rows = (self._slot + self.columns - 1) // self.columns
+        sheet = self._sheet
+        if used_rows < self.rows:
+            sheet = sheet.crop((0, 0, sheet.width, used_rows * self._cell[1]))
+        save_image(sheet, os.path.join(self.output_dir, self._sheet_name()), config=self.config)
+        self._sheet = None
+        self._sheet_number += 1
+    
+    def close(self):
+        """写出最后一张图集和索引"""
+        self._flush_sheet()
+        index = {"version": SINK_INDEX_VERSION, "columns": self.columns, "rows": self.rows,
+                 "sprites": self.index}
+        with open(os.path.join(self.output_dir, "sprites_index.json"), "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+
+def create_sink(kind, output_dir):
+    """按输出方式创建输出目标；dir 返回 None，表示逐张写入文件"""
+    if kind == "dir":
+        return None
+    if kind in ("zip", "tar"):
+        return ArchiveSink(output_dir, kind)
+    if kind == "sprite":
+        return SpriteSheetSink(output_dir, current_config["SPRITE_COLUMNS"],
+                               current_config["SPRITE_ROWS"])
+    raise ValueError(f"未知的输出方式: {kind}")
+
+# 增量生成的清单文件（位于输出目录），记录 输出文件名 -> 内容哈希
+MANIFEST_FILENAME = ".quote_manifest.json"
+MANIFEST_VERSION = 1
+
+def _render_fingerprint(font_path):
+    """返回影响渲染结果的有效配置与字体文件的指纹字符串"""
+    config = {key: value for key, value in current_config.items()
+              if key not in PERFORMANCE_KEYS}
+    
+    # 裸文件名由 FreeType 在系统字体目录中查找，取加载后的实际路径
+    font_file = font_path
+    if font_path:
+        font_file = getattr(font_registry.get_font(font_path, current_config["BASE_FONT_SIZE"]),
+                            "path", font_path)
+    font_id = font_file if isinstance(font_file, str) else None
+    if font_id and os.path.exists(font_id):
+        stat = os.stat(font_id)
+        font_id = [os.path.abspath(font_id), stat.st_size, stat.st_mtime_ns]
+    
+    # 背景图片按绝对路径、大小和修改时间计入，替换同名图片后会重新生成
+    try:
+        background = background_spec(current_config)
+    except ValueError:
+        background = None
+    background_id = background[0] if background is not None else None
+    
+    return json.dumps([MANIFEST_VERSION, config, font_id, background_id],
+                      sort_keys=True, ensure_ascii=False)
+
+def fallback_faces(quote, font_path, config=None):
+    """返回该名言实际用到的回退字形集 [[路径, 序号, 大小, 修改时间], ...]，没有回退时返回 None
+    
+    渲染指纹只包含主字体；安装了覆盖缺字的新字体后回退结果会变，需要计入单条名言的哈希。
+    """
+    choice = font_for_text(quote, font_path, config)
+    if choice == font_path:
+        return None
+    if isinstance(choice, FontStack):
+        faces = [face for _, face in choice.fallbacks]
+    else:
+        faces = [choice if isinstance(choice, tuple) else (choice, 0)]
+    
+    result = []
+    for path, index in faces:
+        try:
+            stat = os.stat(path)
+            result.append([path, index, stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            result.append([path, index])
+    return result
+
+def quote_digest(quote, fingerprint, faces=None):
+    """计算名言与渲染指纹的内容哈希；faces 为 fallback_faces() 的结果，有回退时一并计入"""
+    text = f"{fingerprint}\n{quote}"
+    if faces:
+        text += "\n" + json.dumps(faces, ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def load_manifest(output_dir):
+    """读取输出目录中的增量清单，不存在或损坏时返回空清单"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest["files"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return {}
+
+def save_manifest(output_dir, files):
+    """原子地写入增量清单"""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f, ensure_ascii=False)
+    os.replace(temp_path, manifest_path)
+
+# 断点检查点：记录已完成的图片及其内容哈希，用于中断后续跑和合并分片
+CHECKPOINT_FILENAME = ".quote_checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+# 批量生成时保存检查点的间隔（秒）
+CHECKPOINT_INTERVAL = 10.0
+
+def parse_shard(value):
+    """解析 "k/N" 形式的分片参数，返回 (k, N)，k 从 1 开始"""
+    try:
+        index, count = (int(part) for part in str(value).split("/"))
+    except ValueError:
+        raise ValueError(f"分片格式应为 k/N，例如 1/4: {value}")
+    if not 1 <= index <= count:
+        raise ValueError(f"分片序号应在 1 到 {count} 之间: {value}")
+    return index, count
+
+def checkpoint_path(output_dir, shard=None):
+    """返回检查点文件路径，每个分片各用一个文件，复制到同一目录后也不会冲突"""
+    if shard is None:
+        return os.path.join(output_dir, CHECKPOINT_FILENAME)
+    stem, ext = os.path.splitext(CHECKPOINT_FILENAME)
+    return os.path.join(output_dir, f"{stem}.{shard[0]}-of-{shard[1]}{ext}")
+
+def load_checkpoint(path):
+    """读取检查点，不存在或损坏时返回 None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("version") == CHECKPOINT_VERSION and isinstance(checkpoint["files"], dict):
+            return checkpoint
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return None
+
+def save_checkpoint(path, input_path, shard, files, quotes=None, complete=False):
+    """原子地写入检查点；quotes 为输入文件中的名言总数（读完输入后才知道）"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": CHECKPOINT_VERSION, "input": os.path.abspath(input_path),
+                   "shard": list(shard) if shard else None, "quotes": quotes,
+                   "complete": complete, "files": files}, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def merge_shard_checkpoints(output_dir, status_label=None):
+    """把输出目录中各分片的检查点合并为一份增量清单
+    
+    各分片的输出（含检查点文件）复制到同一目录后调用；全部分片都已完成时写入
+    增量清单并返回 True，之后可用增量模式补跑失败或变化的名言。
+    """
+    prefix, ext = os.path.splitext(CHECKPOINT_FILENAME)
+    checkpoints = {}
+    try:
+        names = os.listdir(output_dir)
+    except OSError:
+        names = []
+    for name in names:
+        if name.startswith(prefix + ".") and name.endswith(ext) and "-of-" in name:
+            checkpoint = load_checkpoint(os.path.join(output_dir, name))
+            if checkpoint is not None and checkpoint.get("shard"):
+                checkpoints[tuple(checkpoint["shard"])] = checkpoint
+    
+    if not checkpoints:
+        _report_status(status_label, f"错误: {output_dir} 中没有分片检查点")
+        return False
+    shard_counts = {count for _, count in checkpoints}
+    if len(shard_counts) > 1:
+        _report_status(status_label, f"错误: 分片总数不一致: {sorted(shard_counts)}")
+        return False
+    
+    shard_count = shard_counts.pop()
+    missing = [k for k in range(1, shard_count + 1) if (k, shard_count) not in checkpoints]
+    unfinished = [k for (k, _), checkpoint in sorted(checkpoints.items())
+                  if not checkpoint.get("complete")]
+    if missing or unfinished:
+        problems = []
+        if missing:
+            problems.append(f"缺少分片 {', '.join(map(str, missing))}")
+        if unfinished:
+            problems.append(f"未完成分片 {', '.join(map(str, unfinished))}")
+        _report_status(status_label, f"错误: 无法合并，{'；'.join(problems)}（共 {shard_count} 片）")
+        return False
+    
+    files = {}
+    for _, checkpoint in sorted(checkpoints.items()):
+        files.update(checkpoint["files"])
+    save_manifest(output_dir, files)
+    
+    quotes = max(checkpoint.get("quotes") or 0 for checkpoint in checkpoints.values())
+    text = f"已合并 {shard_count} 个分片: 共 {quotes} 条名言，生成 {len(files)} 张图片"
+    if len(files) < quotes:
+        text += f"，{quotes - len(files)} 条失败，可用增量模式补跑"
+    _report_status(status_label, text)
+    return True
+
+# 增量生成时暂存被替换的旧图片的目录，名言只是换了行号时从这里移回，不必重新渲染
+STASH_DIRNAME = ".quote_stash"
+
+def _report_status(status_label, text):
+    """更新状态标签；status_label 也可以是接收文本的回调，命令行模式下没有标签时直接打印"""
+    if callable(status_label):
+        status_label(text)
+    elif status_label is not None:
+        status_label.config(text=text)
+    else:
+        print(text)
+
+def count_quotes(input_path, cancel_event=None):
+    """统计输入文件中的名言条数，用于显示进度；cancel_event 被设置时返回 None"""
+    count = 0
+    for count, _ in enumerate(iter_quotes(input_path), 1):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+    return count
+
+def process_quotes_file(input_path, output_dir, status_label=None, workers=None,
+                        incremental=False, stats=None, sink=None, variants=None,
+                        progress=None, cancel_event=None, shard=None, resume=False):
+    """流式处理输入文件并生成图片
+    
+    workers 大于 1 时使用多进程并行渲染；incremental 为 True 时跳过内容哈希
+    未变化的图片，并删除不再对应任何名言的旧输出；传入 RenderStats 时记录
+    每条名言及整个批次的分阶段耗时；sink 指定输出方式（见 OUTPUT_SINKS，
+    默认取配置中的 OUTPUT_SINK）；variants 指定多版本输出（见 resolve_variants，
+    默认取配置中的 VARIANTS），每个版本写入输出目录下以版本名命名的子目录。
+    
+    progress(已处理条数) 在每条名言渲染完成或被跳过后于调用线程中回调；
+    cancel_event（threading.Event）被设置后不再提交新的名言，尚未开始的
+    并行任务也会被取消，已生成的图片保留。
+    
+    非增量地逐张输出到目录时，每隔 CHECKPOINT_INTERVAL 秒把已完成的图片写入
+    检查点；resume 为 True 时跳过检查点中内容哈希未变化且文件仍存在的名言。
+    shard=(k, N) 时只处理序号除以 N 余 k-1 的名言，文件名仍按全局序号编号，
+    各分片的检查点可用 merge_shard_checkpoints 合并。
+    """
+    global _stats
+    previous_stats, _stats = _stats, stats
+    try:
+        return _process_quotes_file(input_path, output_dir, status_label, workers, incremental,
+                                    sink or current_config.get("OUTPUT_SINK", "dir"), variants,
+                                    progress, cancel_event, shard, resume)
+    finally:
+        _stats = previous_stats
+
+def _process_quotes_file(input_path, output_dir, status_label, workers, incremental, sink_kind,
+                         variants, progress, cancel_event, shard, resume):
+    global _write_behind, _variants
     if not os.path.exists(input_path):
-        status_label.config(text="错误: 输入文件不存在")
+        _report_status(status_label, "错误: 输入文件不存在")
         return False
     
-    os.makedirs(output_dir, exist_ok=True)
+    if incremental and sink_kind != "dir":
+        _report_status(status_label, "错误: 增量生成只支持逐张输出到目录")
+        return False
     
-    # 读取文本
     try:
-        with open(input_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except:
-        try:
-            with open(input_path, 'r', encoding='gbk') as f:
-                content = f.read()
-        except:
-            with open(input_path, 'r', encoding='latin-1') as f:
-                content = f.read()
+        variants = resolve_variants(variants)
+    except ValueError as e:
+        _report_status(status_label, f"错误: {e}")
+        return False
+    if variants and (incremental or sink_kind != "dir"):
+        _report_status(status_label, "错误: 多版本输出只支持非增量地逐张输出到目录")
+        return False
+    if (shard is not None or resume) and (incremental or sink_kind != "dir"):
+        _report_status(status_label, "错误: 分片和断点续跑只支持非增量地逐张输出到目录")
+        return False
+    if shard is not None:
+        shard_index, shard_count = shard
+        if not 1 <= shard_index <= shard_count:
+            _report_status(status_label, f"错误: 分片序号应在 1 到 {shard_count} 之间")
+            return False
     
-    quotes = parse_quotes(content)
-    if not quotes:
-        status_label.config(text="错误: 未找到有效的名言")
+    # 背景在主进程中预处理并写入磁盘缓存，工作进程直接映射读取，不再各自解码缩放
+    try:
+        for snapshot in [snapshot for _, snapshot in variants] or [current_config]:
+            canvas_for_config(snapshot)
+    except (OSError, ValueError) as e:
+        _report_status(status_label, f"错误: 无法加载背景: {e}")
         return False
     
+    os.makedirs(output_dir, exist_ok=True)
+    for name, _ in variants:
+        os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+    sink = create_sink(sink_kind, output_dir)
+    payload = sink.payload if sink is not None else None
+    
+    # 逐行读取文本，读到第一条就开始渲染
+    quotes = iter_quotes(input_path)
+    
+    if workers is None:
+        workers = current_config.get("WORKERS", 1)
+    workers = max(1, int(workers))
+    
+    font_path = get_system_font(current_config["FONT_PATH"])
+    
+    # 非增量地逐张输出到目录时记录检查点，新清单同时就是检查点中的已完成列表
+    checkpointing = not incremental and sink_kind == "dir"
+    checkpoint_file = checkpoint_path(output_dir, shard) if checkpointing else None
+    if incremental:
+        old_manifest = load_manifest(output_dir)
+    elif resume:
+        old_manifest = (load_checkpoint(checkpoint_file) or {"files": {}})["files"]
+    else:
+        old_manifest = {}
+    fingerprint = _render_fingerprint(font_path) if incremental or checkpointing else None
+    new_manifest = {}
+    referenced = set()
+    pending_digests = {}
+    
+    # 增量模式下按内容哈希找回换了位置的旧图片：插入或删除行后，后面的名言只需改名
+    stash_dir = os.path.join(output_dir, STASH_DIRNAME)
+    old_by_digest = {digest: filename for filename, digest in old_manifest.items()} if incremental else {}
+    stashed = set()
+    kept = set()
+    
+    quote_count = 0
+    total = 0
+    skipped_count = 0
+    moved_count = 0
     success_count = 0
-    for i, quote in enumerate(quotes):
-        output_path = os.path.join(output_dir, f"quote_{i+1:03d}.png")
+    done_count = 0
+    next_checkpoint = time.perf_counter() + CHECKPOINT_INTERVAL
+    
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+    
+    def report_progress():
+        nonlocal done_count
+        done_count += 1
+        if progress is not None:
+            progress(done_count)
+    
+    def tasks():
+        """生成待渲染任务，增量模式下过滤掉未变化的名言"""
+        nonlocal quote_count, total, skipped_count, moved_count
+        for i, quote in enumerate(quotes):
+            if cancelled():
+                return
+            quote_count += 1
+            if shard is not None and i % shard_count != shard_index - 1:
+                continue
+            total += 1
+            filename = get_output_filename(i)
+            output_path = os.path.join(output_dir, filename)
+            if sink is not None:
+                output_path = None
+            if fingerprint is not None:
+                referenced.add(filename)
+                digest = quote_digest(quote, fingerprint, fallback_faces(quote, font_path))
+                if old_manifest.get(filename) == digest and all(
+                        os.path.exists(path) for path in _output_paths(output_path, variants)):
+                    new_manifest[filename] = digest
+                    kept.add(filename)
+                    skipped_count += 1
+                    report_progress()
+                    continue
+                if incremental and reuse_output(filename, output_path, digest):
+                    new_manifest[filename] = digest
+                    moved_count += 1
+                    report_progress()
+                    continue
+                pending_digests[i] = (filename, digest)
+            yield i, quote, output_path
+    
+    def reuse_output(filename, output_path, digest):
+        """名言换了位置时移用已有的图片，成功时返回 True
+        
+        该位置上的旧图片先移入暂存目录，供后面挪过来的名言取用；只从暂存目录或
+        尚未处理、未变化的位置取图，不会读到正在后台写入的文件。
+        """
+        old_digest = old_manifest.get(filename)
+        try:
+            if old_digest is not None and old_digest != digest and os.path.exists(output_path):
+                os.makedirs(stash_dir, exist_ok=True)
+                os.replace(output_path, os.path.join(stash_dir, old_digest + os.path.splitext(filename)[1]))
+                stashed.add(old_digest)
+            
+            if digest in stashed:
+                os.replace(os.path.join(stash_dir, digest + os.path.splitext(filename)[1]), output_path)
+                stashed.discard(digest)
+                return True
+            
+            source = old_by_digest.get(digest)
+            if source is not None and (source in kept or source not in referenced):
+                source_path = os.path.join(output_dir, source)
+                if os.path.exists(source_path):
+                    shutil.copyfile(source_path, output_path)
+                    return True
+        except OSError as e:
+            print(f"移用旧图片 {filename} 时出错: {str(e)}")
+        return False
+    
+    def discard_failed(failures):
+        """后台写盘失败的图片不计入成功，也不写入清单"""
+        nonlocal success_count
+        failed = set()
+        for output_path, error in failures:
+            print(f"写入图片 {output_path} 时出错: {error}")
+            failed.add(os.path.basename(output_path))
+        success_count -= len(failed)
+        for filename in failed:
+            new_manifest.pop(filename, None)
+    
+    def write_checkpoint(complete=False):
+        """先等后台写盘完成，保证检查点里的图片都已落盘，再保存检查点"""
+        nonlocal next_checkpoint
+        if _write_behind is not None:
+            discard_failed(_write_behind.flush())
+        save_checkpoint(checkpoint_file, input_path, shard, new_manifest,
+                        quote_count if complete else None, complete)
+        next_checkpoint = time.perf_counter() + CHECKPOINT_INTERVAL
+    
+    def on_result(i, ok, data):
+        """记录单条名言的渲染结果，并把输出数据交给输出目标"""
+        nonlocal success_count
+        if ok and sink is not None:
+            try:
+                with _timed("write"):
+                    sink.add(i, get_output_filename(i), data)
+            except Exception as e:
+                print(f"写入第 {i+1} 条名言时出错: {str(e)}")
+                ok = False
+        if ok:
+            success_count += 1
+        if fingerprint is not None:
+            filename, digest = pending_digests.pop(i)
+            if ok:
+                new_manifest[filename] = digest
+        if checkpointing and time.perf_counter() >= next_checkpoint:
+            write_checkpoint()
+        report_progress()
+    
+    if workers > 1:
+        try:
+            _render_parallel(tasks(), workers, on_result, payload, variants or None, cancelled)
+        finally:
+            if sink is not None:
+                sink.close()
+    else:
+        _write_behind = create_write_behind() if sink is None else None
+        _variants = variants or None
+        try:
+            _render_sequential(tasks(), font_path, on_result, payload)
+        finally:
+            _variants = None
+            if sink is not None:
+                sink.close()
+            writer, _write_behind = _write_behind, None
+            if writer is not None:
+                failures = writer.close()
+                if _stats is not None:
+                    encode_seconds, write_seconds = writer.take_timings()
+                    _stats.add_batch_time("encode", encode_seconds)
+                    _stats.add_batch_time("write", write_seconds)
+        
+        if writer is not None:
+            discard_failed(failures)
+    
+    if checkpointing:
+        write_checkpoint(complete=not cancelled())
+    
+    if stashed or os.path.isdir(stash_dir):
+        shutil.rmtree(stash_dir, ignore_errors=True)
+    
+    shard_label = f"分片 {shard_index}/{shard_count}: " if shard is not None else ""
+    if cancelled():
+        # 取消时未读完输入，不能判断哪些旧图片已过期，只保存已完成部分的清单
+        if incremental:
+            old_manifest.update(new_manifest)
+            save_manifest(output_dir, old_manifest)
+        _report_status(status_label, f"已取消: {shard_label}生成了 {success_count} 张图片，"
+                                     f"输出到: {output_dir}")
+        return False
+    
+    if incremental:
+        # 删除清单中已不再对应任何名言的旧图片
+        for filename in set(old_manifest) - referenced:
+            try:
+                os.remove(os.path.join(output_dir, filename))
+            except OSError:
+                pass
+        save_manifest(output_dir, new_manifest)
+    
+    if not total:
+        _report_status(status_label, "错误: 未找到有效的名言")
+        return False
+    
+    if incremental:
+        moved = f"，移用 {moved_count} 张位置变化的图片" if moved_count else ""
+        _report_status(status_label, f"成功生成 {success_count} 张图片，跳过 {skipped_count} 张"
+                                     f"未变化的图片{moved}，输出到: {output_dir}")
+    elif resume or shard is not None:
+        skipped = f"，跳过 {skipped_count} 张已完成的图片" if resume else ""
+        _report_status(status_label, f"{shard_label}成功生成 {success_count} 张图片{skipped}，"
+                                     f"输出到: {output_dir}")
+    elif variants:
+        _report_status(status_label, f"成功生成 {success_count} 条名言的 {len(variants)} 个版本"
+                                     f"（{'、'.join(name for name, _ in variants)}）到: {output_dir}")
+    else:
+        _report_status(status_label, f"成功生成 {success_count} 张图片到: {output_dir}")
+    return True
+
+# 监视模式下检查输入文件和配置文件是否变化的间隔（秒）
+WATCH_INTERVAL = 1.0
+
+def _file_state(path):
+    """返回文件的 (修改时间, 大小)，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def watch_quotes_file(input_path, output_dir, config_path=None, status_label=None, workers=None,
+                      interval=WATCH_INTERVAL, stop_event=None):
+    """监视输入文件和配置文件，每次保存后增量重新生成，直到 stop_event 被设置
+    
+    每隔 interval 秒比较一次文件的修改时间和大小，连续两次相同（编辑器已写完）才处理。
+    指定 config_path 时第一次生成前先加载该配置。输入文件变化时按行的内容哈希只重新渲染新增或修改的名言；配置文件变化时重新加载
+    配置，渲染指纹随之改变，全部图片重新生成，未指定 workers 时按 CPU 核数并行。
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+    
+    def state():
+        return (_file_state(input_path), _file_state(config_path) if config_path else None)
+    
+    processed = None
+    previous = state()
+    _report_status(status_label, f"正在监视 {input_path}，保存后自动更新图片...")
+    while not stop_event.is_set():
+        current = state()
+        if current != processed and current == previous:
+            # 第一次处理前先加载配置文件，之后只在配置文件变化时重新加载
+            config_changed = False
+            run_workers = workers
+            if config_path and (processed is None or current[1] != processed[1]):
+                try:
+                    load_config_file(config_path)
+                except (OSError, ValueError) as e:
+                    # 配置写坏时沿用原配置，等下一次保存
+                    _report_status(status_label, f"错误: 无法加载配置 {config_path}: {str(e)}")
+                else:
+                    config_changed = processed is not None
+                    if config_changed:
+                        _report_status(status_label, "配置已修改，重新生成全部图片...")
+                        if run_workers is None:
+                            run_workers = max(current_config.get("WORKERS", 1), os.cpu_count() or 1)
+            
+            if current[0] is None:
+                _report_status(status_label, f"错误: 输入文件不存在: {input_path}")
+            elif processed is None or current[0] != processed[0] or config_changed:
+                process_quotes_file(input_path, output_dir, status_label, run_workers,
+                                    incremental=True, cancel_event=stop_event)
+            processed = current
+        previous = current
+        stop_event.wait(interval)
+
+# 排版检查时每个工作进程一次处理的名言条数
+DRY_RUN_CHUNK_SIZE = 256
+
+def _dry_run_worker(chunk):
+    """在工作进程中检查一组名言的排版"""
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    return [check_layout(quote, _worker_font_path, draw=draw) for _, quote in chunk]
+
+def _iter_layout_reports(quotes, workers):
+    """按原顺序产出 (序号, 名言, 排版报告)，workers 大于 1 时使用进程池"""
+    if workers <= 1:
+        font_path = get_system_font(current_config["FONT_PATH"])
+        draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+        for i, quote in enumerate(quotes):
+            yield i, quote, check_layout(quote, font_path, draw=draw)
+        return
+    
+    from concurrent.futures import ProcessPoolExecutor
+    
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(dict(current_config, WRITE_BEHIND=0),)) as executor:
+        for chunk in _iter_chunks(enumerate(quotes), DRY_RUN_CHUNK_SIZE):
+            pending.append((chunk, executor.submit(_dry_run_worker, chunk)))
+            if len(pending) >= workers * PARALLEL_TASKS_PER_WORKER:
+                chunk, future = pending.popleft()
+                for (i, quote), report in zip(chunk, future.result()):
+                    yield i, quote, report
+        while pending:
+            chunk, future = pending.popleft()
+            for (i, quote), report in zip(chunk, future.result()):
+                yield i, quote, report
+
+def dry_run_quotes_file(input_path, report_path=None, workers=None, status_label=None):
+    """只排版不渲染地检查输入文件中的全部名言，返回各状态的条数
+    
+    report_path 给出时逐条写入 JSON Lines 报告（序号、状态、字号、行数、文本块高度、
+    最大行宽和名言）；状态为 fit（放得下）、overflow（已用最小字号仍超出文字区域）
+    或 clipped（超出画布，会被裁掉）。
+    """
+    if not os.path.exists(input_path):
+        _report_status(status_label, "错误: 输入文件不存在")
+        return None
+    
+    if workers is None:
+        workers = current_config.get("WORKERS", 1)
+    workers = max(1, int(workers))
+    
+    counts = {LAYOUT_FIT: 0, LAYOUT_OVERFLOW: 0, LAYOUT_CLIPPED: 0}
+    problems = []
+    report_file = open(report_path, "w", encoding="utf-8") if report_path else None
+    try:
+        for i, quote, report in _iter_layout_reports(iter_quotes(input_path), workers):
+            counts[report["status"]] += 1
+            if report["status"] != LAYOUT_FIT and len(problems) < 10:
+                problems.append((i, quote, report))
+            if report_file is not None:
+                report_file.write(json.dumps(dict(index=i + 1, **report, quote=quote),
+                                             ensure_ascii=False) + "\n")
+    finally:
+        if report_file is not None:
+            report_file.close()
+    
+    for i, quote, report in problems:
+        label = "超出文字区域" if report["status"] == LAYOUT_OVERFLOW else "超出画布"
+        print(f"第 {i+1} 条{label}（字号 {report['font_size']}，{report['lines']} 行，"
+              f"高 {report['block_height']}）: {quote[:30]}...")
+    
+    total = sum(counts.values())
+    _report_status(status_label, f"排版检查: 共 {total} 条，放得下 {counts[LAYOUT_FIT]} 条，"
+                                 f"超出文字区域 {counts[LAYOUT_OVERFLOW]} 条，"
+                                 f"超出画布 {counts[LAYOUT_CLIPPED]} 条")
+    return counts
+
+# ---------------------------------------------------------------- HTTP 渲染服务
+
+# 渲染服务缓存的编码后图片总字节数上限
+SERVICE_CACHE_BYTES = 64 * 1024 * 1024
+
+# 单条请求允许的最大文本长度、请求体大小与图片边长
+SERVICE_MAX_TEXT = 2000
+SERVICE_MAX_BODY = 64 * 1024
+SERVICE_MAX_SIDE = 4096
+SERVICE_MAX_FONT_SIZE = 512
+
+# 输出格式 -> Content-Type
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+_HTTP_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+                 405: "Method Not Allowed", 413: "Payload Too Large",
+                 500: "Internal Server Error"}
+
+def parse_color(value):
+    """解析颜色参数，支持 RRGGBB、#RRGGBB 和 r,g,b 三种写法"""
+    if isinstance(value, (list, tuple)):
+        color = tuple(int(c) for c in value)
+    elif "," in value:
+        color = tuple(int(c) for c in value.split(","))
+    else:
+        value = value.lstrip("#")
+        if len(value) != 6:
+            raise ValueError(f"无效的颜色: {value}")
+        color = tuple(int(value[k:k+2], 16) for k in (0, 2, 4))
+    if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+        raise ValueError(f"无效的颜色: {value}")
+    return color
+
+def _parse_side(value):
+    """解析图片边长并限制范围"""
+    value = int(value)
+    if not 16 <= value <= SERVICE_MAX_SIDE:
+        raise ValueError(f"尺寸超出范围 16-{SERVICE_MAX_SIDE}: {value}")
+    return value
+
+def _parse_padding(value):
+    """解析内边距，不能为负；与边长的关系在 parse_request 中检查"""
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"内边距不能为负: {value}")
+    return value
+
+def _parse_font_size(value):
+    """解析字号并限制范围"""
+    value = int(value)
+    if not 1 <= value <= SERVICE_MAX_FONT_SIZE:
+        raise ValueError(f"字号超出范围 1-{SERVICE_MAX_FONT_SIZE}: {value}")
+    return value
+
+def _parse_format(value):
+    """解析输出格式"""
+    if value not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的格式: {value}")
+    return value
+
+# 请求中允许覆盖的样式参数: 参数名 -> (配置项, 解析函数)
+SERVICE_STYLE_PARAMS = {
+    "width": ("IMAGE_WIDTH", _parse_side),
+    "height": ("IMAGE_HEIGHT", _parse_side),
+    "padding": ("PADDING", _parse_padding),
+    "bg": ("BACKGROUND_COLOR", parse_color),
+    "fg": ("TEXT_COLOR", parse_color),
+    "min_font_size": ("MIN_FONT_SIZE", _parse_font_size),
+    "max_font_size": ("MAX_FONT_SIZE", _parse_font_size),
+    "format": ("OUTPUT_FORMAT", _parse_format),
+}
+
+def _render_request(quote, overrides):
+    """在工作进程中按请求的样式渲染并编码一条名言"""
+    config = dict(current_config, **overrides)
+    return encode_image(create_quote_image(quote, font_path=_worker_font_path, config=config),
+                        config=config)
+
+class RenderService:
+    """按需渲染的 HTTP 服务：在进程池中渲染，按字节数限制的 LRU 缓存编码结果
+    
+    GET /render?text=...&width=1080&bg=ffffff 或 POST /render（JSON 请求体）返回图片；
+    支持 ETag / If-None-Match，同一未缓存图片的并发请求只渲染一次。
+    """
+    
+    def __init__(self, workers=None, cache_bytes=SERVICE_CACHE_BYTES):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_bytes = cache_bytes
+        self.fingerprint = _render_fingerprint(get_system_font(current_config["FONT_PATH"]))
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "not_modified": 0, "renders": 0}
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._inflight = {}
+        self._executor = None
+    
+    def parse_request(self, params):
+        """从查询参数或 JSON 请求体中取出 (名言, 样式覆盖项)，参数无效时抛出 ValueError"""
+        text = params.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError("缺少 text 参数")
+        text = text.strip()
+        if len(text) > SERVICE_MAX_TEXT:
+            raise ValueError(f"text 超过 {SERVICE_MAX_TEXT} 个字符")
+        
+        overrides = {}
+        for name, (key, parse) in SERVICE_STYLE_PARAMS.items():
+            if params.get(name) not in (None, ""):
+                try:
+                    overrides[key] = parse(params[name])
+                except (TypeError, OverflowError):
+                    # JSON 请求体中的值可能是列表、对象或无穷大等，统一按参数无效处理
+                    raise ValueError(f"参数 {name} 无效: {params[name]!r}") from None
+        
+        # 相互关联的参数按与配置合并后的实际值检查
+        config = dict(current_config, **overrides)
+        if not 0 <= config["PADDING"] < min(config["IMAGE_WIDTH"], config["IMAGE_HEIGHT"]) / 2:
+            raise ValueError(f"内边距应小于宽高较小者的一半: {config['PADDING']}")
+        if not 1 <= config["MIN_FONT_SIZE"] <= config["MAX_FONT_SIZE"] <= SERVICE_MAX_FONT_SIZE:
+            raise ValueError(f"字号范围无效: {config['MIN_FONT_SIZE']}-{config['MAX_FONT_SIZE']}"
+                             f"（应满足 1 <= 最小字号 <= 最大字号 <= {SERVICE_MAX_FONT_SIZE}）")
+        return text, overrides
+    
+    def cache_key(self, text, overrides):
+        """请求对应的缓存键，同时用作 ETag"""
+        payload = json.dumps([self.fingerprint, text, overrides], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    
+    def _cache_get(self, key):
+        data = self._cache.get(key)
+        if data is not None:
+            self._cache.move_to_end(key)
+        return data
+    
+    def _cache_put(self, key, data):
+        if len(data) > self.cache_bytes:
+            return
+        self._cache[key] = data
+        self._cached_bytes += len(data)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+    
+    async def render(self, text, overrides):
+        """返回 (缓存键, 编码后的图片)，并发的相同请求共享同一次渲染"""
+        import asyncio
+        
+        key = self.cache_key(text, overrides)
+        data = self._cache_get(key)
+        if data is not None:
+            self.stats["hits"] += 1
+            return key, data
+        
+        self.stats["misses"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render_uncached(key, text, overrides))
+            self._inflight[key] = task
+        return key, await asyncio.shield(task)
+    
+    async def _render_uncached(self, key, text, overrides):
+        import asyncio
+        
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self._executor, _render_request, text, overrides)
+            self.stats["renders"] += 1
+            self._cache_put(key, data)
+            return data
+        finally:
+            del self._inflight[key]
+    
+    async def handle_request(self, method, target, headers, body):
+        """处理一个 HTTP 请求，返回 (状态码, 响应头, 响应体)"""
+        from urllib.parse import urlsplit, parse_qsl
+        
+        self.stats["requests"] += 1
+        url = urlsplit(target)
+        
+        if url.path == "/health":
+            return 200, {"Content-Type": "text/plain; charset=utf-8"}, b"ok"
+        if url.path == "/stats":
+            stats = dict(self.stats, cache_entries=len(self._cache), cache_bytes=self._cached_bytes)
+            return 200, {"Content-Type": "application/json"}, json.dumps(stats).encode("utf-8")
+        if url.path != "/render":
+            return 404, {"Content-Type": "text/plain; charset=utf-8"}, "未找到".encode("utf-8")
+        
         try:
-            print(f"处理 {i+1}/{len(quotes)}: {quote[:30]}...")
-            if create_quote_image(quote, output_path=output_path):
-                success_count += 1
+            if method in ("GET", "HEAD"):
+                params = dict(parse_qsl(url.query))
+            elif method == "POST":
+                params = json.loads(body.decode("utf-8") or "{}")
+                if not isinstance(params, dict):
+                    raise ValueError("请求体必须是 JSON 对象")
+            else:
+                return 405, {"Allow": "GET, HEAD, POST"}, b""
+            text, overrides = self.parse_request(params)
+        except ValueError as e:
+            return 400, {"Content-Type": "text/plain; charset=utf-8"}, str(e).encode("utf-8")
+        
+        # ETag 由请求内容决定，客户端已有相同版本时无需渲染
+        etag = f'"{self.cache_key(text, overrides)}"'
+        if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+            self.stats["not_modified"] += 1
+            return 304, {"ETag": etag}, b""
+        
+        try:
+            _, data = await self.render(text, overrides)
         except Exception as e:
-            print(f"生成第 {i+1} 条名言时出错: {str(e)}")
             traceback.print_exc()
+            return 500, {"Content-Type": "text/plain; charset=utf-8"}, f"渲染失败: {e}".encode("utf-8")
+        
+        output_format = overrides.get("OUTPUT_FORMAT", current_config["OUTPUT_FORMAT"])
+        response_headers = {
+            "Content-Type": CONTENT_TYPES[output_format],
+            "ETag": etag,
+            "Cache-Control": "public, max-age=86400",
+        }
+        return 200, response_headers, data
+    
+    async def _handle_connection(self, reader, writer):
+        """处理一个连接上的请求，支持 HTTP/1.1 keep-alive"""
+        import asyncio
+        
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                
+                request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                
+                # Content-Length 只接受非负十进制整数，无效时无法确定请求体边界，回复后关闭连接
+                raw_length = headers.get("content-length") or "0"
+                length = int(raw_length) if raw_length.isascii() and raw_length.isdigit() else None
+                if length is None:
+                    status, response_headers, body = (
+                        400, {"Content-Type": "text/plain; charset=utf-8"},
+                        f"无效的 Content-Length: {raw_length}".encode("utf-8"))
+                    keep_alive = False
+                elif length > SERVICE_MAX_BODY:
+                    status, response_headers, body = 413, {}, b""
+                    keep_alive = False
+                else:
+                    request_body = await reader.readexactly(length) if length else b""
+                    status, response_headers, body = await self.handle_request(
+                        method, target, headers, request_body)
+                    keep_alive = (version == "HTTP/1.1" and
+                                  headers.get("connection", "").lower() != "close")
+                
+                response_headers["Content-Length"] = str(len(body))
+                response_headers["Connection"] = "keep-alive" if keep_alive else "close"
+                lines = [f"HTTP/1.1 {status} {_HTTP_REASONS.get(status, '')}"]
+                lines += [f"{name}: {value}" for name, value in response_headers.items()]
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD" and status != 304:
+                    writer.write(body)
+                await writer.drain()
+                
+                if length is None:
+                    # 请求体未读取，直接关闭会让内核发送 RST 冲掉已写出的响应；先半关闭再丢弃剩余输入
+                    if writer.can_write_eof():
+                        writer.write_eof()
+                    try:
+                        await asyncio.wait_for(reader.read(SERVICE_MAX_BODY), 1.0)
+                    except asyncio.TimeoutError:
+                        pass
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def serve_forever(self, host="127.0.0.1", port=8000):
+        """启动进程池并监听端口，直到被取消"""
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+            initargs=(dict(current_config, WRITE_BEHIND=0),))
+        try:
+            server = await asyncio.start_server(self._handle_connection, host, port)
+            print(f"渲染服务已启动: http://{host}:{port}/render?text=...")
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+def serve(host="127.0.0.1", port=8000, workers=None, cache_bytes=SERVICE_CACHE_BYTES):
+    """以前台方式运行 HTTP 渲染服务，Ctrl+C 退出"""
+    import asyncio
     
-    status_label.config(text=f"成功生成 {success_count} 张图片到: {output_dir}")
-    return True
+    service = RenderService(workers, cache_bytes)
+    try:
+        asyncio.run(service.serve_forever(host, port))
+    except KeyboardInterrupt:
+        print("渲染服务已停止")
+
+# 图形界面刷新进度的间隔与预览的防抖延迟（毫秒）
+PROGRESS_POLL_MS = 100
+PREVIEW_DELAY_MS = 200
 
 def create_gui():
     """创建图形用户界面"""
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, colorchooser, ttk
+    
     window = tk.Tk()
     window.title("名言图片生成器")
     window.geometry("900x700")
@@ -333,6 +3342,7 @@ The journey of a thousand miles begins with one step"""
         # 在文本框中显示示例
         input_text.delete("1.0", tk.END)
         input_text.insert(tk.END, example)
+        schedule_preview()
     
     tk.Button(input_frame, text="加载示例", command=load_example_text, 
              font=("Arial", 10)).grid(row=0, column=3, padx=5)
@@ -345,6 +3355,67 @@ The journey of a thousand miles begins with one step"""
     input_text.pack(fill=tk.BOTH, expand=True, pady=5)
     input_text.insert(tk.END, "在此输入您的名言文本，每行一条...")
     
+    # 预览 - 右侧，显示光标所在名言的缩小版本
+    preview_frame = tk.LabelFrame(right_frame, text="预览", font=("Arial", 10, "bold"),
+                                bg="white", padx=10, pady=10)
+    preview_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+    
+    preview_label = tk.Label(preview_frame, bg="white", text="在左侧输入名言后显示预览",
+                           font=("Arial", 10), fg="#666")
+    preview_label.pack(fill=tk.BOTH, expand=True)
+    
+    preview_job = None
+    
+    # 首次运行时扫描系统字体建立覆盖索引可能需要较长时间，放到后台线程，完成前不渲染预览
+    font_index_ready = threading.Event()
+    
+    def build_font_index():
+        try:
+            font_index.load(current_config.get("FONT_DIRS"))
+        finally:
+            font_index_ready.set()
+    
+    threading.Thread(target=build_font_index, daemon=True).start()
+    
+    def selected_quote():
+        """光标所在行的名言，该行为空时取第一条"""
+        line = input_text.get("insert linestart", "insert lineend").strip()
+        if line:
+            return line
+        quotes = parse_quotes(input_text.get("1.0", tk.END))
+        return quotes[0] if quotes else None
+    
+    def update_preview():
+        nonlocal preview_job
+        preview_job = None
+        quote = selected_quote()
+        if not quote:
+            return
+        if not font_index_ready.is_set():
+            preview_label.config(image="", text="正在建立字体索引，完成后显示预览...")
+            preview_job = window.after(PROGRESS_POLL_MS, update_preview)
+            return
+        try:
+            img = render_preview(quote)
+            buffer = io.BytesIO()
+            img.save(buffer, "PNG", compress_level=1)
+            photo = tk.PhotoImage(data=buffer.getvalue())
+        except Exception as e:
+            preview_label.config(image="", text=f"预览失败: {str(e)}")
+            return
+        preview_label.config(image=photo, text="")
+        preview_label.image = photo  # 保持引用，避免被回收
+    
+    def schedule_preview(event=None):
+        """拖动滑块或输入时合并频繁的刷新请求，停顿后再渲染预览"""
+        nonlocal preview_job
+        if preview_job is not None:
+            window.after_cancel(preview_job)
+        preview_job = window.after(PREVIEW_DELAY_MS, update_preview)
+    
+    input_text.bind("<KeyRelease>", schedule_preview)
+    input_text.bind("<ButtonRelease-1>", schedule_preview)
+    
     # 输出目录选择
     output_frame = tk.LabelFrame(left_frame, text="输出设置", font=("Arial", 10, "bold"),
                               bg="white", padx=10, pady=10)
@@ -366,15 +3437,81 @@ The journey of a thousand miles begins with one step"""
     tk.Button(output_frame, text="浏览...", command=browse_output_dir, 
              font=("Arial", 10)).grid(row=0, column=2, padx=5)
     
+    incremental_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(output_frame, text="增量生成（跳过未变化的图片）", variable=incremental_var,
+                  font=("Arial", 10), bg="white").grid(row=1, column=0, columnspan=3, sticky="w")
+    
     # 操作按钮
     button_frame = tk.Frame(left_frame, bg="white")
     button_frame.pack(fill=tk.X, pady=15)
     
-    # 状态提示
+    # 进度条与状态提示
+    progress_frame = tk.Frame(left_frame, bg="white")
+    progress_frame.pack(fill=tk.X, before=button_frame)
+    
+    progress_bar = ttk.Progressbar(progress_frame, mode="determinate")
+    progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+    
+    eta_label = tk.Label(progress_frame, text="", fg="#666", font=("Arial", 9), bg="white")
+    eta_label.pack(side=tk.RIGHT, padx=5)
+    
     status_label = tk.Label(button_frame, text="准备生成图片...", fg="#333", 
                           font=("Arial", 10), bg="white", wraplength=400)
     status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
     
+    # 生成线程只向队列发送消息，由主线程定时取出并更新界面（Tk 不是线程安全的）
+    events = queue.Queue()
+    cancel_event = threading.Event()
+    
+    # 最近加载或保存的配置文件，监视模式下一并监视
+    config_path_var = tk.StringVar(value="")
+    
+    def poll_events():
+        """处理生成线程的消息，同一轮中只应用最新的进度"""
+        latest_progress = None
+        finished = False
+        try:
+            while True:
+                event = events.get_nowait()
+                if event[0] == "progress":
+                    latest_progress = event[1:]
+                elif event[0] == "status":
+                    status_label.config(text=event[1])
+                elif event[0] == "done":
+                    finished = True
+        except queue.Empty:
+            pass
+        
+        if latest_progress is not None:
+            done, total, started = latest_progress
+            if total is None:
+                # 后台计数尚未完成，进度条保持滚动，只显示已完成条数
+                eta_label.config(text=f"{done}")
+            else:
+                if str(progress_bar.cget("mode")) != "determinate":
+                    progress_bar.stop()
+                    progress_bar.config(mode="determinate")
+                progress_bar.config(maximum=max(total, 1), value=done)
+                elapsed = time.monotonic() - started
+                if done and total > done:
+                    eta_label.config(text=f"{done}/{total}  剩余约 {elapsed / done * (total - done):.0f} 秒")
+                else:
+                    eta_label.config(text=f"{done}/{total}")
+        
+        if finished:
+            progress_bar.stop()
+            progress_bar.config(mode="determinate")
+            generate_button.config(state=tk.NORMAL)
+            watch_button.config(state=tk.NORMAL)
+            cancel_button.config(state=tk.DISABLED)
+        else:
+            window.after(PROGRESS_POLL_MS, poll_events)
+    
+    def cancel_generation():
+        cancel_event.set()
+        cancel_button.config(state=tk.DISABLED)
+        status_label.config(text="正在取消...")
+    
     def generate_images():
         input_path = input_path_entry.get()
         output_dir = output_dir_entry.get()
@@ -405,21 +3542,89 @@ The journey of a thousand miles begins with one step"""
             return
             
         status_label.config(text="正在生成图片，请稍候...")
+        progress_bar.config(mode="indeterminate", value=0)
+        progress_bar.start()
+        eta_label.config(text="")
+        cancel_event.clear()
+        # 生成与监视共用模块级的写盘器和统计，同一时间只能运行一个
+        generate_button.config(state=tk.DISABLED)
+        watch_button.config(state=tk.DISABLED)
+        cancel_button.config(state=tk.NORMAL)
+        incremental = incremental_var.get()
         
         # 在单独的线程中运行生成过程
         def run_generation():
+            total = None
+            
+            def count():
+                """在另一个线程中统计总条数，计数完成前进度条为不确定模式"""
+                nonlocal total
+                total = count_quotes(input_path, cancel_event)
+            
             try:
-                process_quotes_file(input_path, output_dir, status_label)
+                started = time.monotonic()
+                threading.Thread(target=count, daemon=True).start()
+                process_quotes_file(input_path, output_dir,
+                                    lambda text: events.put(("status", text)),
+                                    incremental=incremental,
+                                    progress=lambda done: events.put(("progress", done, total, started)),
+                                    cancel_event=cancel_event)
             except Exception as e:
-                status_label.config(text=f"生成错误: {str(e)}")
+                events.put(("status", f"生成错误: {str(e)}"))
+            finally:
+                events.put(("done",))
         
         thread = threading.Thread(target=run_generation)
         thread.daemon = True
         thread.start()
+        window.after(PROGRESS_POLL_MS, poll_events)
     
-    tk.Button(button_frame, text="生成图片", command=generate_images, 
-             bg="#4a86e8", fg="white", font=("Arial", 10, "bold"),
-             padx=15, pady=8).pack(side=tk.RIGHT)
+    def watch_images():
+        """在后台线程中监视输入文件和已加载的配置文件，保存后自动更新图片，按“取消”停止"""
+        input_path = input_path_entry.get()
+        output_dir = output_dir_entry.get()
+        if input_path == "示例文本已加载到下方输入框" or not os.path.exists(input_path):
+            status_label.config(text="错误: 监视模式需要选择输入文件")
+            return
+        if not output_dir:
+            status_label.config(text="错误: 请选择输出目录")
+            return
+        
+        progress_bar.config(value=0)
+        eta_label.config(text="")
+        cancel_event.clear()
+        generate_button.config(state=tk.DISABLED)
+        watch_button.config(state=tk.DISABLED)
+        cancel_button.config(state=tk.NORMAL)
+        config_path = config_path_var.get() or None
+        
+        def run_watch():
+            try:
+                watch_quotes_file(input_path, output_dir, config_path,
+                                  lambda text: events.put(("status", text)),
+                                  stop_event=cancel_event)
+            except Exception as e:
+                events.put(("status", f"监视错误: {str(e)}"))
+            finally:
+                events.put(("done",))
+        
+        thread = threading.Thread(target=run_watch)
+        thread.daemon = True
+        thread.start()
+        window.after(PROGRESS_POLL_MS, poll_events)
+    
+    generate_button = tk.Button(button_frame, text="生成图片", command=generate_images, 
+                               bg="#4a86e8", fg="white", font=("Arial", 10, "bold"),
+                               padx=15, pady=8)
+    generate_button.pack(side=tk.RIGHT)
+    
+    watch_button = tk.Button(button_frame, text="监视", command=watch_images,
+                            font=("Arial", 10), padx=10, pady=8)
+    watch_button.pack(side=tk.RIGHT, padx=5)
+    
+    cancel_button = tk.Button(button_frame, text="取消", command=cancel_generation,
+                             font=("Arial", 10), padx=10, pady=8, state=tk.DISABLED)
+    cancel_button.pack(side=tk.RIGHT, padx=5)
     
     # =================== 高级设置页面 ===================
     
@@ -433,6 +3638,7 @@ The journey of a thousand miles begins with one step"""
             # 颜色值是 (r, g, b) 元组
             color_var.set(f"当前: RGB{color}")
             current_config[setting_name] = tuple(int(c) for c in color)
+            schedule_preview()
     
     # 颜色设置 - 移除了强调色
     color_frame = tk.LabelFrame(settings_frame, text="颜色设置", font=("Arial", 10, "bold"), 
@@ -461,6 +3667,45 @@ The journey of a thousand miles begins with one step"""
                  command=lambda sn=setting_name, cv=color_vars[setting_name]: choose_color(sn, cv),
                  font=("Arial", 10)).grid(row=i, column=2, padx=5, pady=5)
     
+    # 背景图片：渐变和叠加层在配置文件中设置
+    background_row = len(colors_settings)
+    tk.Label(color_frame, text="背景图片:", font=("Arial", 10), 
+            bg="white").grid(row=background_row, column=0, sticky="w", padx=5, pady=5)
+    
+    background_var = tk.StringVar()
+    
+    def show_background():
+        if current_config.get("BACKGROUND_IMAGE"):
+            background_var.set(os.path.basename(current_config["BACKGROUND_IMAGE"]))
+        else:
+            background_var.set("无（纯色背景）")
+    show_background()
+    
+    tk.Label(color_frame, textvariable=background_var, font=("Arial", 10), 
+            bg="white").grid(row=background_row, column=1, sticky="w", padx=5, pady=5)
+    
+    def choose_background():
+        file_path = filedialog.askopenfilename(
+            title="选择背景图片",
+            filetypes=[("图片文件", "*.png;*.jpg;*.jpeg;*.webp;*.bmp"), ("所有文件", "*.*")]
+        )
+        if file_path:
+            current_config["BACKGROUND_IMAGE"] = file_path
+            show_background()
+            schedule_preview()
+    
+    def clear_background():
+        current_config["BACKGROUND_IMAGE"] = None
+        show_background()
+        schedule_preview()
+    
+    background_buttons = tk.Frame(color_frame, bg="white")
+    background_buttons.grid(row=background_row, column=2, padx=5, pady=5)
+    tk.Button(background_buttons, text="选择图片", command=choose_background, 
+             font=("Arial", 10)).pack(side=tk.LEFT)
+    tk.Button(background_buttons, text="清除", command=clear_background, 
+             font=("Arial", 10)).pack(side=tk.LEFT, padx=(5, 0))
+    
     # 尺寸设置
     size_frame = tk.LabelFrame(settings_frame, text="尺寸设置", font=("Arial", 10, "bold"), 
                              bg="white", padx=10, pady=10)
@@ -491,6 +3736,98 @@ The journey of a thousand miles begins with one step"""
     
     def update_size_setting(setting_name, value):
         current_config[setting_name] = int(float(value))
+        schedule_preview()
+    
+    # 性能设置
+    perf_frame = tk.LabelFrame(settings_frame, text="性能设置", font=("Arial", 10, "bold"), 
+                             bg="white", padx=10, pady=10)
+    perf_frame.pack(fill=tk.X, pady=10)
+    perf_frame.columnconfigure(1, weight=1)
+    
+    tk.Label(perf_frame, text="并行进程数:", font=("Arial", 10), 
+            bg="white").grid(row=0, column=0, sticky="w", padx=5, pady=5)
+    
+    workers_var = tk.IntVar(value=current_config["WORKERS"])
+    tk.Scale(perf_frame, from_=1, to=max(os.cpu_count() or 1, 1), orient=tk.HORIZONTAL,
+            variable=workers_var, bg="white", font=("Arial", 10),
+            command=lambda val: update_size_setting("WORKERS", val)
+            ).grid(row=0, column=1, columnspan=2, sticky="we", padx=5, pady=5)
+    
+    tk.Label(perf_frame, text="后台写盘队列:", font=("Arial", 10), 
+            bg="white").grid(row=1, column=0, sticky="w", padx=5, pady=5)
+    
+    write_behind_var = tk.IntVar(value=current_config["WRITE_BEHIND"])
+    tk.Scale(perf_frame, from_=0, to=32, orient=tk.HORIZONTAL,
+            variable=write_behind_var, bg="white", font=("Arial", 10),
+            command=lambda val: update_size_setting("WRITE_BEHIND", val)
+            ).grid(row=1, column=1, columnspan=2, sticky="we", padx=5, pady=5)
+    
+    pipeline_settings = [
+        ("ENCODE_THREADS", "编码线程数", 1, 8),
+        ("WRITE_THREADS", "写盘线程数", 1, 8),
+        ("MAX_IN_FLIGHT", "最大在途图片数", 1, 256),
+    ]
+    
+    for i, (setting_name, label, min_val, max_val) in enumerate(pipeline_settings, start=2):
+        tk.Label(perf_frame, text=label+":", font=("Arial", 10), 
+                bg="white").grid(row=i, column=0, sticky="w", padx=5, pady=5)
+        
+        var = tk.IntVar(value=current_config[setting_name])
+        tk.Scale(perf_frame, from_=min_val, to=max_val, orient=tk.HORIZONTAL,
+                variable=var, bg="white", font=("Arial", 10),
+                command=lambda val, sn=setting_name: update_size_setting(sn, val)
+                ).grid(row=i, column=1, columnspan=2, sticky="we", padx=5, pady=5)
+    
+    # 输出格式设置
+    format_frame = tk.LabelFrame(settings_frame, text="输出格式", font=("Arial", 10, "bold"), 
+                               bg="white", padx=10, pady=10)
+    format_frame.pack(fill=tk.X, pady=10)
+    format_frame.columnconfigure(1, weight=1)
+    format_frame.columnconfigure(3, weight=1)
+    
+    tk.Label(format_frame, text="图片格式:", font=("Arial", 10), 
+            bg="white").grid(row=0, column=0, sticky="w", padx=5, pady=5)
+    
+    format_var = tk.StringVar(value=current_config["OUTPUT_FORMAT"])
+    format_box = ttk.Combobox(format_frame, textvariable=format_var, state="readonly",
+                              values=sorted(OUTPUT_FORMATS), width=10)
+    format_box.grid(row=0, column=1, sticky="w", padx=5, pady=5)
+    format_box.bind("<<ComboboxSelected>>",
+                    lambda event: current_config.update(OUTPUT_FORMAT=format_var.get()))
+    
+    webp_lossless_var = tk.BooleanVar(value=current_config["WEBP_LOSSLESS"])
+    tk.Checkbutton(format_frame, text="WebP 无损", variable=webp_lossless_var, bg="white",
+                  font=("Arial", 10),
+                  command=lambda: current_config.update(WEBP_LOSSLESS=webp_lossless_var.get())
+                  ).grid(row=0, column=2, columnspan=2, sticky="w", padx=5, pady=5)
+    
+    tk.Label(format_frame, text="输出方式:", font=("Arial", 10), 
+            bg="white").grid(row=3, column=0, sticky="w", padx=5, pady=5)
+    
+    sink_var = tk.StringVar(value=current_config["OUTPUT_SINK"])
+    sink_box = ttk.Combobox(format_frame, textvariable=sink_var, state="readonly",
+                            values=OUTPUT_SINKS, width=10)
+    sink_box.grid(row=3, column=1, sticky="w", padx=5, pady=5)
+    sink_box.bind("<<ComboboxSelected>>",
+                  lambda event: current_config.update(OUTPUT_SINK=sink_var.get()))
+    
+    encoder_settings = [
+        ("PNG_COMPRESS_LEVEL", "PNG 压缩级别", 0, 9),
+        ("PNG_PALETTE_COLORS", "PNG 调色板颜色", 0, 256),
+        ("JPEG_QUALITY", "JPEG 质量", 1, 95),
+        ("WEBP_QUALITY", "WebP 质量", 0, 100),
+    ]
+    
+    for i, (setting_name, label, min_val, max_val) in enumerate(encoder_settings):
+        row, column = 1 + i // 2, (i % 2) * 2
+        tk.Label(format_frame, text=label+":", font=("Arial", 10), 
+                bg="white").grid(row=row, column=column, sticky="w", padx=5, pady=5)
+        
+        var = tk.IntVar(value=current_config[setting_name])
+        tk.Scale(format_frame, from_=min_val, to=max_val, orient=tk.HORIZONTAL,
+                variable=var, bg="white", font=("Arial", 10),
+                command=lambda val, sn=setting_name: update_size_setting(sn, val)
+                ).grid(row=row, column=column+1, sticky="we", padx=5, pady=5)
     
     # 字体设置
     font_frame = tk.LabelFrame(settings_frame, text="字体设置", font=("Arial", 10, "bold"), 
@@ -515,8 +3852,11 @@ The journey of a thousand miles begins with one step"""
             filetypes=[("字体文件", "*.ttf;*.ttc;*.otf"), ("所有文件", "*.*")]
         )
         if file_path:
+            if file_path != current_config["FONT_PATH"]:
+                font_registry.clear()
             current_config["FONT_PATH"] = file_path
             font_var.set(os.path.basename(file_path))
+            schedule_preview()
     
     tk.Button(font_frame, text="选择字体", command=choose_font, 
              font=("Arial", 10)).grid(row=0, column=2, padx=5, pady=5)
@@ -534,6 +3874,7 @@ The journey of a thousand miles begins with one step"""
         if file_path:
             with open(file_path, "w", encoding="utf-8") as f:
                 json.dump(current_config, f, indent=4)
+            config_path_var.set(file_path)
             messagebox.showinfo("成功", "配置已保存")
     
     def load_config():
@@ -543,24 +3884,27 @@ The journey of a thousand miles begins with one step"""
         )
         if file_path:
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    loaded = json.load(f)
-                    current_config.update(loaded)
-                    
-                    # 更新UI
-                    for setting in color_vars:
-                        if setting in current_config:
-                            color_vars[setting].set(f"当前: RGB{tuple(current_config[setting])}")
-                    
-                    if "FONT_PATH" in current_config and current_config["FONT_PATH"]:
-                        font_var.set(os.path.basename(current_config["FONT_PATH"]))
-                    
-                    messagebox.showinfo("成功", "配置已加载")
+                load_config_file(file_path)
+                config_path_var.set(file_path)
+                
+                # 更新UI
+                for setting in color_vars:
+                    if setting in current_config:
+                        color_vars[setting].set(f"当前: RGB{tuple(current_config[setting])}")
+                
+                if "FONT_PATH" in current_config and current_config["FONT_PATH"]:
+                    font_var.set(os.path.basename(current_config["FONT_PATH"]))
+                show_background()
+                schedule_preview()
+                
+                messagebox.showinfo("成功", "配置已加载")
             except Exception as e:
                 messagebox.showerror("错误", f"加载配置失败: {str(e)}")
     
     def reset_config():
         global current_config
+        if current_config["FONT_PATH"] != DEFAULT_CONFIG["FONT_PATH"]:
+            font_registry.clear()
         current_config = DEFAULT_CONFIG.copy()
         
         # 更新UI
@@ -569,6 +3913,8 @@ The journey of a thousand miles begins with one step"""
                 color_vars[setting].set(f"当前: RGB{current_config[setting]}")
         
         font_var.set("使用系统默认字体")
+        show_background()
+        schedule_preview()
         
         messagebox.showinfo("成功", "配置已重置为默认值")
     
@@ -601,16 +3947,90 @@ The journey of a thousand miles begins with one step"""
                          font=("Arial", 9), justify=tk.LEFT)
     help_label.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
     
+    schedule_preview()
     window.mainloop()
 
+def main(argv=None):
+    """命令行入口：给出输入文件时直接渲染，否则启动图形界面"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        description="名言图片生成器：每行一条名言，批量生成图片；不带参数时启动图形界面")
+    parser.add_argument("input", nargs="?", help="包含名言的文本文件（每行一条）")
+    parser.add_argument("-o", "--output", default="quote_images", help="输出目录（默认: quote_images）")
+    parser.add_argument("-c", "--config", help="JSON 配置文件，例如 q.json")
+    parser.add_argument("-j", "--workers", type=int, help="并行进程数（默认取配置中的 WORKERS）")
+    parser.add_argument("-f", "--format", choices=sorted(OUTPUT_FORMATS), help="输出图片格式")
+    parser.add_argument("-s", "--sink", choices=OUTPUT_SINKS,
+                        help="输出方式: dir 逐张写文件, zip/tar 写入单个归档, sprite 拼接精灵图")
+    parser.add_argument("-V", "--variants", help="多版本输出，逗号分隔的预设名，如 landscape,square,story,thumb")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="增量生成：跳过内容未变化的图片，删除过期的输出")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="监视输入文件和配置文件，保存后只重新生成变化的名言（Ctrl+C 退出）")
+    parser.add_argument("--shard", type=parse_shard, metavar="K/N",
+                        help="只处理第 K 片（共 N 片，按行序号轮流分配），文件名保持全局编号")
+    parser.add_argument("--resume", action="store_true",
+                        help="从输出目录中的检查点继续，跳过已完成的图片")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="合并输出目录中各分片的检查点，生成增量清单")
+    parser.add_argument("--profile", metavar="REPORT", help="记录分阶段耗时并写入 JSON 报告")
+    parser.add_argument("--dry-run", nargs="?", const="", metavar="REPORT",
+                        help="只检查排版（字号、行数、是否放得下）不生成图片，可选写入 JSON Lines 报告")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="在指定端口启动 HTTP 渲染服务")
+    parser.add_argument("--host", default="127.0.0.1", help="渲染服务监听地址（默认: 127.0.0.1）")
+    parser.add_argument("--cache-mb", type=int, default=SERVICE_CACHE_BYTES // (1024 * 1024),
+                        help="渲染服务的图片缓存上限（MB）")
+    parser.add_argument("--gui", action="store_true", help="加载配置后启动图形界面")
+    args = parser.parse_args(argv)
+    
+    if args.config:
+        load_config_file(args.config)
+    if args.format:
+        current_config["OUTPUT_FORMAT"] = args.format
+    if args.workers is not None:
+        current_config["WORKERS"] = args.workers
+    if args.variants:
+        current_config["VARIANTS"] = [name.strip() for name in args.variants.split(",") if name.strip()]
+    
+    if args.serve is not None:
+        serve(args.host, args.serve, args.workers, args.cache_mb * 1024 * 1024)
+        return 0
+    
+    if args.merge_shards:
+        return 0 if merge_shard_checkpoints(args.output) else 1
+    
+    if args.gui or not args.input:
+        print("="*60)
+        print("名言图片生成器")
+        print("="*60)
+        print(f"图片尺寸: {current_config['IMAGE_WIDTH']}×{current_config['IMAGE_HEIGHT']}")
+        print(f"字体范围: {current_config['MIN_FONT_SIZE']} - {current_config['MAX_FONT_SIZE']} 像素")
+        print(f"背景色: {current_config['BACKGROUND_COLOR']}")
+        print(f"文字色: {current_config['TEXT_COLOR']}")
+        print("="*60)
+        
+        create_gui()
+        return 0
+    
+    if args.dry_run is not None:
+        counts = dry_run_quotes_file(args.input, args.dry_run or None)
+        return 0 if counts and not counts[LAYOUT_CLIPPED] else 1
+    
+    if args.watch:
+        try:
+            watch_quotes_file(args.input, args.output, args.config, workers=args.workers)
+        except KeyboardInterrupt:
+            print("已停止监视")
+        return 0
+    
+    stats = RenderStats() if args.profile else None
+    ok = process_quotes_file(args.input, args.output, incremental=args.incremental, stats=stats,
+                             sink=args.sink, shard=args.shard, resume=args.resume)
+    if stats is not None:
+        stats.save(args.profile)
+        print("\n".join(stats.summary()))
+    return 0 if ok else 1
+
 if __name__ == "__main__":
-    print("="*60)
-    print("名言图片生成器")
-    print("="*60)
-    print(f"图片尺寸: {current_config['IMAGE_WIDTH']}×{current_config['IMAGE_HEIGHT']}")
-    print(f"字体范围: {current_config['MIN_FONT_SIZE']} - {current_config['MAX_FONT_SIZE']} 像素")
-    print(f"背景色: {current_config['BACKGROUND_COLOR']}")
-    print(f"文字色: {current_config['TEXT_COLOR']}")
-    print("="*60)
-    
-    create_gui()
\ No newline at end of file
+    sys.exit(main())